@@ -1,2 +1,14 @@
-from abacusSoftware.main import run, open_stdout, close_stdout
 from .constants import __version__
+
+def run():
+    "Starts the graphical interface, Qt is only imported here"
+    from abacusSoftware.main import run
+    run()
+
+def open_stdout():
+    from abacusSoftware.main import open_stdout
+    open_stdout()
+
+def close_stdout():
+    from abacusSoftware.main import close_stdout
+    close_stdout()
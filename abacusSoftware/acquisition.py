@@ -0,0 +1,213 @@
+import numpy as np
+from time import time
+from collections import deque
+from itertools import combinations
+from threading import Thread, Event, Lock, RLock
+
+import abacusSoftware.constants as constants
+import pyAbacus as abacus
+
+PORT_LOCKS = {}
+
+def getCombinations(n_channels):
+    letters = [chr(i + ord('A')) for i in range(n_channels)]
+    joined = "".join(letters)
+    for i in range(2, n_channels + 1):
+        letters += ["".join(pair) for pair in combinations(joined, i)]
+    return letters
+
+def portLock(port):
+    """ Returns the lock that serializes every transaction on `port`. """
+    return PORT_LOCKS.setdefault(port, RLock())
+
+def settingLabel(setting):
+    "Name of a setting in the settings file, None for the ones that are not logged"
+    if setting == "sampling":
+        return "Sampling time (ms)"
+    if setting == "coincidence_window":
+        return "Coincidence Window (ns)"
+    if setting.startswith("delay_"):
+        return "Delay %s (ns)" % setting[6:]
+    if setting.startswith("sleep_"):
+        return "Sleep %s (ns)" % setting[6:]
+    return None
+
+class SettingsQueue(object):
+    """
+    Settings waiting to be written to a device. A setting put again before
+    the flush only replaces its value, so a burst of changes becomes a single
+    write, and `flush` writes every pending setting holding the port once.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.pending = {} # setting: value, in the order they were put
+
+    def put(self, setting, value):
+        self.pending[setting] = value
+
+    def flush(self):
+        """
+        Writes the pending settings. Returns the written ones and the
+        InvalidValueError of the ones pyAbacus rejected, as dicts. When any
+        other error stops the writes, the settings not written yet are queued
+        again before it is raised.
+        """
+        pending = self.pending
+        self.pending = {}
+        written = {}
+        invalid = {}
+        with portLock(self.port):
+            for (setting, value) in pending.items():
+                try:
+                    abacus.setSetting(self.port, setting, value)
+                    written[setting] = value
+                except abacus.InvalidValueError as e:
+                    invalid[setting] = e
+                except Exception:
+                    unwritten = dict((key, pending[key]) for key in pending if (key not in written) and (key not in invalid))
+                    unwritten.update(self.pending)
+                    self.pending = unwritten
+                    raise
+        return written, invalid
+
+    def __len__(self):
+        return len(self.pending)
+
+class SettingsCache(object):
+    """
+    Last settings read from a device. They are read again only when a local
+    write marked them as stale, or once `interval` seconds passed since the
+    last read (never when it is 0), so settings reads do not take the serial
+    port from the counters.
+    """
+    def __init__(self, port, interval = constants.SETTINGS_POLL_INTERVAL):
+        self.port = port
+        self.interval = interval
+        self.settings = None
+        self.last_read = 0
+        self.stale = True
+
+    def invalidate(self):
+        "Marks the settings to be read back, after a write"
+        self.stale = True
+
+    def isDue(self):
+        if self.stale: return True
+        return (self.interval > 0) and (time() - self.last_read >= self.interval)
+
+    def read(self):
+        with portLock(self.port):
+            self.settings = abacus.getAllSettings(self.port)
+        self.last_read = time()
+        self.stale = False
+        return self.settings
+
+class AcquisitionWorker(object):
+    """
+    Polls the counters of a device on its own thread. Finished rows are handed
+    to the GUI through `rows`, a deque that is safe to append on one thread and
+    pop on another, so the GUI never blocks on serial I/O.
+
+    Rows hold the time, the ID and one value per entry of `columns`, which
+    defaults to every combination of the device.
+    """
+    def __init__(self, port, combinations, number_channels, init_time = 0, last_id = 0, columns = None):
+        self.port = port
+        self.combinations = combinations
+        self.number_channels = number_channels
+        self.active_channels = []
+        self.columns = combinations
+        if columns != None: self.columns = columns
+        self.sources = []
+        self.init_time = init_time
+        self.last_id = last_id
+        self.rows = deque()
+        self.lock = Lock() # keeps a row and the columns it was built with together
+        self.error = None
+        self.thread = None
+        self.stop_event = Event()
+        self.updateSources()
+
+    def setActiveChannels(self, active_channels):
+        with self.lock:
+            self.active_channels = list(active_channels)
+            self.updateSources()
+
+    def setColumns(self, columns):
+        "Changes the stored columns, returns the pending rows built with the old ones"
+        with self.lock:
+            rows = list(self.rows)
+            self.rows.clear()
+            self.columns = list(columns)
+            self.updateSources()
+        return rows
+
+    def updateSources(self):
+        """
+        Maps every column to the counter that holds it. Multi-fold coincidences
+        are read from the custom counters in the order they were enabled, and
+        are None (stored as 0) when they are not enabled.
+        """
+        last = 3
+        if self.number_channels == 4:
+            last = 10
+        elif self.number_channels == 8:
+            last = 36
+        sources = dict((letters, letters) for letters in self.combinations[:last])
+        if self.number_channels > 2:
+            i = 1
+            for letters in self.combinations[last:]:
+                if letters in self.active_channels:
+                    sources[letters] = "custom_c%d" % i
+                    i += 1
+        self.sources = [sources.get(letters) for letters in self.columns]
+
+    def start(self):
+        if self.isRunning(): return
+        self.stop_event.clear()
+        self.thread = Thread(target = self.heavyDuty)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+
+    def isRunning(self):
+        return (self.thread != None) and self.thread.is_alive()
+
+    def getRows(self, dtype):
+        "Pops every finished row into a structured array, returns None if there is none"
+        n = len(self.rows)
+        if n == 0: return None
+        return np.array([self.rows.popleft() for i in range(n)], dtype = dtype)
+
+    def buildRow(self, counters, time_, id):
+        values = [0 if source == None else counters.getValue(source) for source in self.sources]
+        return tuple([time_, id] + values)
+
+    def heavyDuty(self):
+        tries = 0
+        while not self.stop_event.is_set():
+            time_left = 0
+            try:
+                with portLock(self.port):
+                    time_ = time() - self.init_time
+                    counters, id = abacus.getAllCounters(self.port)
+                    if (id > 0) and (id != self.last_id):
+                        with self.lock:
+                            self.rows.append(self.buildRow(counters, time_, id))
+                        self.last_id = id
+                    time_left = abacus.getTimeLeft(self.port) / 1000 # seconds
+                tries = 0
+            except abacus.BaseError as e:
+                tries += 1
+                if tries == constants.NUMBER_OF_TRIES:
+                    self.error = e
+                    tries = 0
+            except Exception as e: # a lost port or an unexpected error ends the polling
+                self.error = e
+                break
+            self.stop_event.wait(max(time_left, constants.ACQUISITION_MIN_WAIT))
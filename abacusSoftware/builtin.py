@@ -1,14 +1,13 @@
 import abacusSoftware.constants as constants
 import abacusSoftware.common as common
 # from abacusSoftware.supportWidgets import SamplingWidget
-from abacusSoftware.files import File
+from abacusSoftware.sweep import SweepRunner, SLEEP, COINCIDENCE_WINDOW, delaySweep, sleepSweep, gridSweep, gridPoints
+from abacusSoftware.fitting import fitPeaks
 import pyAbacus as abacus
 
 import os
-import time
 import numpy as np
 import pyqtgraph as pg
-from threading import Thread
 from abacusSoftware.supportWidgets import ClickableLineEdit
 
 try:
@@ -23,6 +22,8 @@ except ModuleNotFoundError:
 
 
 class SweepDialogBase(QDialog):
+    DIMENSIONS = 1 # settings swept at once
+
     def __init__(self, parent):
         super(SweepDialogBase, self).__init__(parent)
         self.resize(400, 500)
@@ -58,6 +59,9 @@ class SweepDialogBase(QDialog):
         stopLabel = QLabel("Stop time (ns):")
         stepLabel = QLabel("Step size (ns):")
         nLabel = QLabel("Number of measurements per step:")
+        resumeLabel = QLabel("Resume from file:")
+        targetLabel = QLabel("Target counts per step:")
+        stepTimeLabel = QLabel("Time per step:")
 
         self.samplingLabel = QLabel("")
         self.setSampling(0)
@@ -68,6 +72,13 @@ class SweepDialogBase(QDialog):
         self.stepSpin = QSpinBox()
         self.nSpin = QSpinBox()
         self.nSpin.setMinimum(1)
+        self.targetSpin = QSpinBox()
+        self.targetSpin.setRange(0, 10 ** 9)
+        self.targetSpin.setSpecialValueText("All measurements")
+        self.targetSpin.setValue(constants.SWEEP_TARGET_COUNTS)
+        self.stepTimeLabel = QLabel("")
+        self.resumeCheckBox = QtWidgets.QCheckBox()
+        self.resumeCheckBox.setToolTip("Loads the points already saved in the file and measures only the missing ones.")
 
         self.startSpin.lineEdit().setReadOnly(True)
         self.stopSpin.lineEdit().setReadOnly(True)
@@ -79,6 +90,8 @@ class SweepDialogBase(QDialog):
         self.stopSpin.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         self.stepSpin.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         self.nSpin.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.targetSpin.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.stepTimeLabel.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
 
         self.startSpin.valueChanged.connect(self.handleStart)
 
@@ -88,6 +101,9 @@ class SweepDialogBase(QDialog):
         self.formLayout.addRow(stopLabel, self.stopSpin)
         self.formLayout.addRow(stepLabel, self.stepSpin)
         self.formLayout.addRow(nLabel, self.nSpin)
+        self.formLayout.addRow(targetLabel, self.targetSpin)
+        self.formLayout.addRow(resumeLabel, self.resumeCheckBox)
+        self.formLayout.addRow(stepTimeLabel, self.stepTimeLabel)
 
         self.verticalLayout.addWidget(self.groupBox)
 
@@ -100,16 +116,15 @@ class SweepDialogBase(QDialog):
 
         symbolSize = 5
         self.plot_line = self.plot.plot(pen = "r", symbol='o', symbolPen = "r", symbolBrush="r", symbolSize=symbolSize)
+        self.plot_lines = [self.plot_line]
+        self.legend = None
         self.verticalLayout.addWidget(self.plot_win)
 
         self.fileName = ""
 
         self.startStopButton.clicked.connect(self.startStop)
 
-        self.x_data = []
-        self.y_data = []
-
-        self.completed = False
+        self.runner = None
 
         self.timer = QtCore.QTimer()
         self.timer.setInterval(constants.CHECK_RATE)
@@ -117,8 +132,6 @@ class SweepDialogBase(QDialog):
 
         self.header = None
 
-        self.error = None
-
     def handleStart(self, value):
         self.stopSpin.setMinimum(value + abacus.constants.DELAY_STEP_VALUE)
 
@@ -136,36 +149,99 @@ class SweepDialogBase(QDialog):
         self.stopSpin.setEnabled(enable)
         self.stepSpin.setEnabled(enable)
         self.nSpin.setEnabled(enable)
+        self.targetSpin.setEnabled(enable)
+        self.resumeCheckBox.setEnabled(enable)
         try:
             self.comboBox.setEnabled(enable)
         except:
             pass
 
+    def setLines(self, names = None):
+        "Plots one line per measured channel, a single red line when names is None"
+        for line in self.plot_lines:
+            self.plot.removeItem(line)
+        if self.legend != None:
+            if self.legend.scene() != None:
+                self.legend.scene().removeItem(self.legend)
+            self.legend = None
+        symbolSize = 5
+        if names == None:
+            self.plot_line = self.plot.plot(pen = "r", symbol='o', symbolPen = "r", symbolBrush="r", symbolSize=symbolSize)
+            self.plot_lines = [self.plot_line]
+        else:
+            self.legend = self.plot.addLegend()
+            n = len(constants.COLORS)
+            self.plot_lines = []
+            for (i, name) in enumerate(names):
+                color = constants.COLORS[i % n]
+                self.plot_lines.append(self.plot.plot(pen = color, symbol='o', symbolPen = color,
+                                                        symbolBrush = color, symbolSize = symbolSize, name = name))
+            self.plot_line = self.plot_lines[0]
+
+    def getData(self):
+        "Returns the measured steps, sorted, and a row of values for each one"
+        if self.runner == None:
+            return np.zeros(0), np.zeros((0, len(self.plot_lines)))
+        x_data, y_data = self.runner.results.get()
+        if (self.DIMENSIONS > 1) or np.all(x_data[1:] >= x_data[:-1]):
+            return x_data, y_data
+        order = np.argsort(x_data, kind = "stable")
+        return x_data[order], y_data[order]
+
     def updatePlot(self):
-        self.plot_line.setData(self.x_data, self.y_data)
-        if self.error != None:
-            self.parent.errorWindow(self.error)
-            self.error = None
-
-        if self.completed:
-            if self.fileName != "":
-                file = File(self.fileName, self.header)
-                data = np.vstack((self.x_data, self.y_data)).T
-                file.npwrite(data, "%d" + constants.DELIMITER + "%d")
-
-            self.x_data = []
-            self.y_data = []
+        finished = self.runner.finished.is_set() # before reading, so the last points are drawn
+        x_data, y_data = self.getData()
+        self.drawData(x_data, y_data)
+        self.updateStepTime()
+        if self.runner.error != None:
+            self.parent.errorWindow(self.runner.error)
+            self.runner.error = None
+
+        if finished:
+            self.sweepFinished(x_data, y_data)
             self.timer.stop()
-            self.completed = False
             self.startStopButton.setText("Start")
             self.startStopButton.setStyleSheet("background-color: none")
             self.enableWidgets(True)
+            if self.parent.settings_cache != None:
+                self.parent.settings_cache.invalidate() # the sweep left other settings on the device
             self.parent.check_timer.start()
 
+    def drawData(self, x_data, y_data):
+        for (i, line) in enumerate(self.plot_lines):
+            line.setData(x_data, y_data[:, i])
+
+    def updateStepTime(self):
+        if self.runner != None:
+            step_time = self.runner.sweep.getStepTime()
+            if step_time != None:
+                self.stepTimeLabel.setText("%.3f s" % step_time)
+
+    def sweepFinished(self, x_data, y_data):
+        "Called with the results once a sweep ends"
+        pass
+
+    def startSweep(self, range_, channels, n, make_steps, finest = None):
+        """
+        Measures range_ on a thread, see SweepRunner. Points are written to
+        the file as they are measured, and with resume the points already in
+        the file are loaded instead of measured again.
+        """
+        self.stepTimeLabel.setText("")
+        self.runner = SweepRunner(self.parent.port_name, range_, channels, n, self.parent.sampling_widget.getValue(),
+                                    make_steps, self.header, self.fileName, self.targetSpin.value(), self.DIMENSIONS,
+                                    finest, self.resumeCheckBox.isChecked())
+        self.timer.start()
+        self.runner.start()
+
+    def stopSweep(self):
+        if self.runner != None:
+            self.runner.stop()
+
     def cleanPlot(self):
-        self.x_data = []
-        self.y_data = []
-        self.plot_line.setData(self.x_data, self.y_data)
+        self.runner = None
+        for line in self.plot_lines:
+            line.setData([], [])
 
     def chooseFile(self):
         try:
@@ -176,7 +252,8 @@ class SweepDialogBase(QDialog):
         dlg = QFileDialog(directory = directory)
         dlg.setAcceptMode(QFileDialog.AcceptSave)
         dlg.setFileMode(QFileDialog.AnyFile)
-        nameFilters = [constants.SUPPORTED_EXTENSIONS[extension] for extension in constants.SUPPORTED_EXTENSIONS]
+        nameFilters = [constants.SUPPORTED_EXTENSIONS[extension] for extension in constants.SUPPORTED_EXTENSIONS \
+                        if extension not in constants.BINARY_EXTENSIONS]
         dlg.setNameFilters(nameFilters)
         dlg.selectNameFilter(constants.SUPPORTED_EXTENSIONS[constants.EXTENSION_DATA])
         if dlg.exec_():
@@ -210,6 +287,15 @@ class SweepDialogBase(QDialog):
         self.plot.getAxis('left').setPen()
 
 class DelayDialog(SweepDialogBase):
+    """
+    Sweeps the delay between two channels. With "All" as channel 2, every
+    other channel is delayed at once against channel 1 and each two-fold
+    coincidence with channel 1 is measured on the same steps, which covers
+    every pair since the delay of a pair is the difference of the delays of
+    its channels to channel 1.
+    """
+    ALL_CHANNELS = "All"
+
     def __init__(self, parent):
         super(DelayDialog, self).__init__(parent)
         self.setWindowTitle("Delay time sweep")
@@ -233,6 +319,22 @@ class DelayDialog(SweepDialogBase):
         self.formLayout.insertRow(0, QLabel("Channel 2:"), self.comboBox2)
         self.formLayout.insertRow(0, QLabel("Channel 1:"), self.comboBox1)
 
+        self.channel1 = None
+        self.others = []
+        self.adaptiveCheckBox = QtWidgets.QCheckBox()
+        self.adaptiveCheckBox.setToolTip("Measures the range at the step size, then zooms in on the coincidence peak down to the finest step.")
+        self.formLayout.addRow(QLabel("Adaptive (coarse to fine):"), self.adaptiveCheckBox)
+
+        self.fit_delays = {}
+        self.fitLabel = QLabel("")
+        self.fitLabel.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.applyButton = QPushButton("Apply delay")
+        self.applyButton.setToolTip("Sets the delays that center the fitted coincidence peaks.")
+        self.applyButton.setEnabled(False)
+        self.applyButton.clicked.connect(self.applyDelay)
+        self.formLayout.addRow(QLabel("Peak fit:"), self.fitLabel)
+        self.formLayout.addRow(self.applyButton)
+
         self.startSpin.setMinimum(-abacus.constants.DELAY_MAXIMUM_VALUE)
         self.startSpin.setMaximum(abacus.constants.DELAY_MAXIMUM_VALUE - abacus.constants.DELAY_STEP_VALUE)
         self.startSpin.setSingleStep(abacus.constants.DELAY_STEP_VALUE)
@@ -254,7 +356,7 @@ class DelayDialog(SweepDialogBase):
     def channelsChange(self, index):
         i1 = self.comboBox1.currentIndex()
         i2 = self.comboBox2.currentIndex()
-        if(i1 == i2):
+        if(i1 == i2) and (self.number_channels > 0):
             self.comboBox2.setCurrentIndex((i1 + 1) % self.number_channels)
 
     def createComboBox(self):
@@ -267,10 +369,7 @@ class DelayDialog(SweepDialogBase):
 
     def startStop(self):
         if self.startStopButton.text() == "Stop":
-            self.timer.stop()
-            self.completed = True
-            self.updatePlot()
-            self.completed = True
+            self.stopSweep()
 
         else:
             step = self.stepSpin.value()
@@ -295,72 +394,75 @@ class DelayDialog(SweepDialogBase):
 
     def run(self, n, range_):
         self.cleanPlot()
-        self.completed = False
         self.startStopButton.setText("Stop")
         self.startStopButton.setStyleSheet("background-color: green")
         self.enableWidgets(False)
 
-        self.header = "Delay time (ns)"  + constants.DELIMITER +  "Coincidences"
-
         self.parent.check_timer.stop()
-        thread = Thread(target = self.heavyDuty, args = (n, range_))
-        thread.daemon = True
-        self.timer.start()
-        thread.start()
-
-    def heavyDuty(self, n, range_):
-        port = self.parent.port_name
         channel1 = self.comboBox1.currentText()
         channel2 = self.comboBox2.currentText()
-        if port != None:
-            try:
-                for delay in range_:
-                    value = 0
-                    last_id = 0
-                    if delay > 0:
-                        delay1 = 0
-                        delay2 = delay
-                    else:
-                        delay1 = abs(delay)
-                        delay2 = 0
-                    delay1_ = -1
-                    delay2_ = -1
-                    for j in range(constants.NUMBER_OF_TRIES):
-                        abacus.setSetting(port, "delay_%s" % channel1, delay1)
-                        abacus.setSetting(port, "delay_%s" % channel2, delay2)
-                        time.sleep(1e-3)
-                        try:
-                            delay1_ = abacus.getSetting(port, "delay_%s" % channel1)
-                            delay2_ = abacus.getSetting(port, "delay_%s" % channel2)
-                            if ((delay1 != delay1_) and (delay2 != delay2_)): break
-                        except abacus.BaseError as e:
-                            time.sleep(1e-2)
-                            if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
-
-                    time.sleep(self.parent.sampling_widget.getValue() / 1000)
-
-                    for i in range(n):
-                        for j in range(constants.NUMBER_OF_TRIES):
-                            if self.completed: return
-                            try:
-                                counters, id = abacus.getFollowingCounters(port, [channel1 + channel2])
-                                if (id != last_id) and (id != 0):
-                                    value += counters.getValue(channel1 + channel2)
-                                    last_id = id
-                                    break
-                                else:
-                                    time_left = abacus.getTimeLeft(port) / 1000 # seconds
-                                    time.sleep(time_left)
-
-                            except abacus.BaseError as e:
-                                if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
-
-                    self.x_data.append(delay)
-                    self.y_data.append(value / n)
-                self.completed = True
-            except Exception as e:
-                self.completed = True
-                self.error = e
+        if channel2 == self.ALL_CHANNELS:
+            others = [chr(i + ord('A')) for i in range(self.number_channels) if chr(i + ord('A')) != channel1]
+        else:
+            others = [channel2]
+        pairs, self.header, make_steps = delaySweep(channel1, others)
+
+        if channel2 == self.ALL_CHANNELS:
+            self.setLines(pairs)
+        else:
+            self.setLines()
+
+        self.channel1 = channel1
+        self.others = others
+        self.fit_delays = {}
+        self.fitLabel.setText("")
+        self.applyButton.setEnabled(False)
+        finest = None
+        if self.adaptiveCheckBox.isChecked():
+            finest = abacus.constants.DELAY_STEP_VALUE
+        self.startSweep(range_, pairs, n, make_steps, finest)
+
+    def enableWidgets(self, enable):
+        super(DelayDialog, self).enableWidgets(enable)
+        self.adaptiveCheckBox.setEnabled(enable)
+
+    def sweepFinished(self, x_data, y_data):
+        """
+        Fits the peak of every pair. A peak at a positive delay is centered by
+        delaying the other channel, so the delays keep the differences of the
+        fitted centers and channel 1 takes the delay of the most negative one.
+        """
+        if len(x_data) < 3: return
+        center, width, height, background = fitPeaks(x_data, y_data)
+        lines = []
+        for (i, other) in enumerate(self.others):
+            pair = "".join(sorted(self.channel1 + other))
+            if np.isnan(center[i]):
+                lines.append("%s: no peak" % pair)
+            else:
+                lines.append("%s: %.1f ns, FWHM %.1f ns, background %.1f" % (pair, center[i], width[i], background[i]))
+        self.fitLabel.setText("\n".join(lines))
+
+        found = ~np.isnan(center)
+        if found.any():
+            step = abacus.constants.DELAY_STEP_VALUE
+            delays = np.round(center / step).astype(int) * step
+            offset = max(0, -delays[found].min())
+            self.fit_delays = {self.channel1: int(offset)}
+            for (i, other) in enumerate(self.others):
+                if found[i]:
+                    self.fit_delays[other] = int(np.clip(delays[i] + offset, abacus.constants.DELAY_MINIMUM_VALUE,
+                                                            abacus.constants.DELAY_MAXIMUM_VALUE))
+            self.applyButton.setEnabled(True)
+
+    def applyDelay(self):
+        "Sends the fitted delays to the device through the main window"
+        for letter in sorted(self.fit_delays):
+            widget = self.parent.delay_widgets[ord(letter) - ord('A')]
+            widget.blockSignals(True)
+            widget.setValue(self.fit_delays[letter])
+            widget.blockSignals(False)
+            self.parent.delayMethod(widget, letter, widget.value())
 
     def setNumberChannels(self, number_channels):
         self.number_channels = number_channels
@@ -370,6 +472,8 @@ class DelayDialog(SweepDialogBase):
         self.comboBox2.clear()
         self.comboBox1.addItems([chr(i + ord('A')) for i in range(number_channels)])
         self.comboBox2.addItems([chr(i + ord('A')) for i in range(number_channels)])
+        if number_channels > 2:
+            self.comboBox2.addItem(self.ALL_CHANNELS)
 
         self.comboBox2.setCurrentIndex(1)
 
@@ -431,10 +535,7 @@ class SleepDialog(SweepDialogBase):
 
     def startStop(self):
         if self.startStopButton.text() == "Stop":
-            self.timer.stop()
-            self.completed = True
-            self.updatePlot()
-            self.completed = True
+            self.stopSweep()
 
         else:
             step = self.stepSpin.value()
@@ -460,62 +561,13 @@ class SleepDialog(SweepDialogBase):
 
     def run(self, channel, n, range_):
         self.cleanPlot()
-        self.completed = False
         self.startStopButton.setText("Stop")
         self.startStopButton.setStyleSheet("background-color: green")
         self.enableWidgets(False)
 
-        self.header = "Sleep time (ns)"  + constants.DELIMITER +  "Counts (%s)"%channel
-
         self.parent.check_timer.stop()
-        thread = Thread(target = self.heavyDuty, args = (channel, n, range_))
-        thread.daemon = True
-        self.timer.start()
-        thread.start()
-
-    def heavyDuty(self, channel, n, range_):
-        port = self.parent.port_name
-        if port != None:
-            try:
-                for sleep in range_:
-                    value = 0
-                    last_id = 0
-                    sleep_ = -1
-                    for j in range(constants.NUMBER_OF_TRIES):
-                        try:
-                            abacus.setSetting(port, 'sleep_%s' % channel, sleep)
-                            time.sleep(1e-3)
-                            sleep_ = abacus.getSetting(port, "sleep_%s" % channel)
-                            if (sleep != sleep_): break
-                        except abacus.BaseError as e:
-                            time.sleep(1e-2)
-                            if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
-
-                    time.sleep(self.parent.sampling_widget.getValue() / 1000)
-
-                    for i in range(n): # number of points
-                        for j in range(constants.NUMBER_OF_TRIES): # tries
-                            if self.completed: return
-                            try:
-                                counters, id = abacus.getFollowingCounters(port, [channel])
-                                if (id != last_id) and (id != 0):
-                                    last_id = id
-                                    value += counters.getValue(channel)
-                                    break
-                                else:
-                                    time_left = abacus.getTimeLeft(port) / 1000 # seconds
-                                    time.sleep(time_left)
-
-                            except abacus.BaseError as e:
-                                if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
-
-                    self.x_data.append(sleep)
-                    self.y_data.append(value / n)
-                self.completed = True
-
-            except Exception as e:
-                self.completed = True
-                self.error = e
+        channels, self.header, make_steps = sleepSweep(channel)
+        self.startSweep(range_, channels, n, make_steps)
 
     def setNumberChannels(self, number_channels):
         self.comboBox.clear()
@@ -539,3 +591,211 @@ class SleepDialog(SweepDialogBase):
             self.stepSpin.setValue(abacus.constants.SLEEP_STEP_VALUE) #new on v1.4.0 (2020-06-30)
         except AttributeError as e:
             if abacus.constants.DEBUG: print(e)
+
+class GridDialog(SweepDialogBase):
+    """
+    Sweeps the delay between two channels against a second setting, the sleep
+    time of both channels or the coincidence window. The grid is measured in
+    serpentine order, so a single setting changes between consecutive points,
+    and drawn as a heatmap of the coincidences. The swept settings are set
+    back to the values of the main window once the sweep ends.
+    """
+    DIMENSIONS = 2
+    SLEEP = SLEEP
+    COINCIDENCE_WINDOW = COINCIDENCE_WINDOW
+
+    def __init__(self, parent):
+        super(GridDialog, self).__init__(parent)
+        self.setWindowTitle("Delay time grid sweep")
+
+        self.number_channels = 0
+        self.channel1 = None
+        self.channel2 = None
+        self.setting = None
+        self.delays = []
+        self.values = []
+
+        self.comboBox1 = QComboBox()
+        self.comboBox2 = QComboBox()
+        self.settingComboBox = QComboBox()
+        for comboBox in [self.comboBox1, self.comboBox2, self.settingComboBox]:
+            comboBox.setEditable(True)
+            comboBox.lineEdit().setReadOnly(True)
+            comboBox.lineEdit().setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.comboBox1.currentIndexChanged.connect(self.channelsChange)
+        self.comboBox2.currentIndexChanged.connect(self.channelsChange)
+        self.settingComboBox.addItems([self.SLEEP, self.COINCIDENCE_WINDOW])
+        self.settingComboBox.currentIndexChanged.connect(self.settingChange)
+
+        self.setNumberChannels(4)
+
+        self.formLayout.insertRow(0, QLabel("Channel 2:"), self.comboBox2)
+        self.formLayout.insertRow(0, QLabel("Channel 1:"), self.comboBox1)
+
+        self.start2Spin = QSpinBox()
+        self.stop2Spin = QSpinBox()
+        self.step2Spin = QSpinBox()
+        for spin in [self.start2Spin, self.stop2Spin, self.step2Spin]:
+            spin.lineEdit().setReadOnly(True)
+            spin.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.start2Spin.valueChanged.connect(self.handleStart2)
+
+        self.formLayout.addRow(QLabel("Second setting:"), self.settingComboBox)
+        self.formLayout.addRow(QLabel("Second start (ns):"), self.start2Spin)
+        self.formLayout.addRow(QLabel("Second stop (ns):"), self.stop2Spin)
+        self.formLayout.addRow(QLabel("Second step size (ns):"), self.step2Spin)
+
+        "the heatmap replaces the line"
+        self.plot.removeItem(self.plot_line)
+        self.plot_lines = []
+        self.image = pg.ImageItem()
+        colormap = pg.ColorMap([0, 0.5, 1], [(0, 0, 80), (200, 40, 40), (255, 255, 0)])
+        self.image.setLookupTable(colormap.getLookupTable(0, 1, 256))
+        self.plot.addItem(self.image)
+
+        self.updateConstants()
+        self.plot.setLabel('bottom', "Delay time", units='ns')
+
+    def handleStart2(self, value):
+        self.stop2Spin.setMinimum(value + self.step2Spin.minimum())
+
+    def channelsChange(self, index):
+        i1 = self.comboBox1.currentIndex()
+        i2 = self.comboBox2.currentIndex()
+        if(i1 == i2) and (self.number_channels > 0):
+            self.comboBox2.setCurrentIndex((i1 + 1) % self.number_channels)
+
+    def settingChange(self, index = None):
+        if self.settingComboBox.currentText() == self.SLEEP:
+            minimum = abacus.constants.SLEEP_MINIMUM_VALUE
+            maximum = abacus.constants.SLEEP_MAXIMUM_VALUE
+            step = abacus.constants.SLEEP_STEP_VALUE
+        else:
+            minimum = abacus.constants.COINCIDENCE_WINDOW_MINIMUM_VALUE
+            maximum = abacus.constants.COINCIDENCE_WINDOW_MAXIMUM_VALUE
+            step = abacus.constants.COINCIDENCE_WINDOW_STEP_VALUE
+        self.start2Spin.setMinimum(minimum)
+        self.start2Spin.setMaximum(maximum - step)
+        self.start2Spin.setSingleStep(step)
+        self.start2Spin.setValue(minimum)
+
+        self.stop2Spin.setMinimum(minimum)
+        self.stop2Spin.setMaximum(maximum)
+        self.stop2Spin.setSingleStep(step)
+        self.stop2Spin.setValue(maximum)
+
+        self.step2Spin.setMinimum(step)
+        self.step2Spin.setMaximum(((maximum - minimum) // step) * step)
+        self.step2Spin.setSingleStep(step)
+        self.step2Spin.setValue(step)
+        self.plot.setLabel('left', self.settingComboBox.currentText(), units='ns')
+
+    def enableWidgets(self, enable):
+        super(GridDialog, self).enableWidgets(enable)
+        for widget in [self.settingComboBox, self.start2Spin, self.stop2Spin, self.step2Spin]:
+            widget.setEnabled(enable)
+
+    def startStop(self):
+        if self.startStopButton.text() == "Stop":
+            self.stopSweep()
+
+        else:
+            n = self.nSpin.value()
+            delays = np.arange(self.startSpin.value(), self.stopSpin.value() + 1, self.stepSpin.value())
+            delays = delays[delays <= abacus.constants.DELAY_MAXIMUM_VALUE]
+            values = np.arange(self.start2Spin.value(), self.stop2Spin.value() + 1, self.step2Spin.value())
+            values = values[values <= self.stop2Spin.maximum()]
+
+            if self.parent.port_name == None:
+                self.parent.connect()
+            if self.parent.port_name != None:
+                if self.parent.streaming:
+                    if self.stopAcquisition():
+                        self.run(n, delays, values)
+                else:
+                    self.run(n, delays, values)
+
+    def run(self, n, delays, values):
+        self.cleanPlot()
+        self.startStopButton.setText("Stop")
+        self.startStopButton.setStyleSheet("background-color: green")
+        self.enableWidgets(False)
+
+        self.parent.check_timer.stop()
+        self.channel1 = self.comboBox1.currentText()
+        self.channel2 = self.comboBox2.currentText()
+        self.setting = self.settingComboBox.currentText()
+        self.delays = delays
+        self.values = values
+        channels, self.header, make_steps = gridSweep(self.channel1, self.channel2, self.setting)
+        self.startSweep(gridPoints(delays, values), channels, n, make_steps)
+
+    def drawData(self, x_data, y_data):
+        if len(x_data) == 0:
+            self.image.clear()
+            return
+        i = np.clip(np.searchsorted(self.delays, x_data[:, 0]), 0, len(self.delays) - 1)
+        j = np.clip(np.searchsorted(self.values, x_data[:, 1]), 0, len(self.values) - 1)
+        "points loaded from a file may fall out of the grid"
+        on_grid = (self.delays[i] == x_data[:, 0]) & (self.values[j] == x_data[:, 1])
+        if not on_grid.any():
+            self.image.clear()
+            return
+        z = y_data[on_grid, 0]
+        image = np.full((len(self.delays), len(self.values)), z.min())
+        image[i[on_grid], j[on_grid]] = z
+        self.image.setImage(image, levels = (z.min(), max(z.max(), z.min() + 1)))
+
+        delay_step = 1
+        value_step = 1
+        if len(self.delays) > 1: delay_step = self.delays[1] - self.delays[0]
+        if len(self.values) > 1: value_step = self.values[1] - self.values[0]
+        self.image.setRect(QtCore.QRectF(self.delays[0] - delay_step / 2, self.values[0] - value_step / 2,
+                                            delay_step * len(self.delays), value_step * len(self.values)))
+
+    def sweepFinished(self, x_data, y_data):
+        "Sets the swept settings back to the ones of the main window"
+        for letter in [self.channel1, self.channel2]:
+            if letter == None: continue
+            i = ord(letter) - ord('A')
+            if i < len(self.parent.delay_widgets):
+                self.parent.delayMethod(self.parent.delay_widgets[i], letter, self.parent.delay_widgets[i].value())
+                if self.setting == self.SLEEP:
+                    self.parent.sleepMethod(self.parent.sleep_widgets[i], letter, self.parent.sleep_widgets[i].value())
+        if self.setting == self.COINCIDENCE_WINDOW:
+            self.parent.coincidenceWindowMethod(self.parent.coincidence_spinBox.value())
+
+    def setNumberChannels(self, number_channels):
+        self.number_channels = number_channels
+        self.comboBox1.blockSignals(True)
+        self.comboBox2.blockSignals(True)
+        self.comboBox1.clear()
+        self.comboBox2.clear()
+        self.comboBox1.addItems([chr(i + ord('A')) for i in range(number_channels)])
+        self.comboBox2.addItems([chr(i + ord('A')) for i in range(number_channels)])
+
+        self.comboBox2.setCurrentIndex(1)
+
+        self.comboBox1.blockSignals(False)
+        self.comboBox2.blockSignals(False)
+
+    def updateConstants(self):
+        try:
+            self.startSpin.setMinimum(-abacus.constants.DELAY_MAXIMUM_VALUE)
+            self.startSpin.setMaximum(abacus.constants.DELAY_MAXIMUM_VALUE - abacus.constants.DELAY_STEP_VALUE)
+            self.startSpin.setSingleStep(abacus.constants.DELAY_STEP_VALUE)
+            self.startSpin.setValue(-abacus.constants.DELAY_MAXIMUM_VALUE)
+
+            self.stopSpin.setMinimum(-abacus.constants.DELAY_MAXIMUM_VALUE)
+            self.stopSpin.setMaximum(abacus.constants.DELAY_MAXIMUM_VALUE)
+            self.stopSpin.setSingleStep(abacus.constants.DELAY_STEP_VALUE)
+            self.stopSpin.setValue(abacus.constants.DELAY_MAXIMUM_VALUE)
+
+            self.stepSpin.setMinimum(abacus.constants.DELAY_STEP_VALUE)
+            self.stepSpin.setMaximum(((abacus.constants.DELAY_MAXIMUM_VALUE - abacus.constants.DELAY_MINIMUM_VALUE) // abacus.constants.DELAY_STEP_VALUE) * abacus.constants.DELAY_STEP_VALUE)
+            self.stepSpin.setSingleStep(abacus.constants.DELAY_STEP_VALUE)
+            self.stepSpin.setValue(abacus.constants.DELAY_STEP_VALUE)
+
+            self.settingChange()
+        except AttributeError as e:
+            if abacus.constants.DEBUG: print(e)
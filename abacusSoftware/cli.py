@@ -0,0 +1,317 @@
+"""
+Command line interface. Without a command the graphical interface is
+started; the commands run without importing Qt, so they can be used on
+servers and for long unattended runs.
+
+    abacusSoftware acquire --port /dev/ttyACM0 --sampling 100 --duration 3600 --out run.npy
+    abacusSoftware sweep sweeps.ini
+"""
+import os
+import argparse
+import configparser
+import numpy as np
+from threading import Thread
+from time import time, localtime, strftime, sleep
+
+from serial.serialutil import SerialException
+
+import abacusSoftware.constants as constants
+from abacusSoftware.files import File
+from abacusSoftware.session import DeviceSession, deviceSuffix
+from abacusSoftware.sweep import SweepRunner, SLEEP, COINCIDENCE_WINDOW, delaySweep, sleepSweep, gridSweep, gridPoints
+from abacusSoftware.acquisition import portLock
+import pyAbacus as abacus
+
+def openDevice(port = None):
+    """
+    Opens a device given by its name or serial port, or the first device
+    found when port is None. Returns the name of the opened device.
+    """
+    if (port == None) or ("ABACUS" in port.upper()):
+        devices = list(abacus.findDevices(print_on = False)[0].keys())
+        if len(devices) == 0:
+            raise abacus.AbacusError(constants.CONNECT_EMPTY_LABEL)
+        if port == None:
+            port = devices[0]
+    opened = abacus.open(port)
+    if opened != None: port = opened
+    return port
+
+def splitName(name):
+    "Returns the prefix and the data extension of an output file name"
+    prefix, extention = os.path.splitext(name)
+    if extention not in constants.SUPPORTED_EXTENSIONS:
+        return name, constants.EXTENSION_DATA
+    return prefix, extention
+
+def acquire(args):
+    """
+    Records every port given at the same time on one clock. With several
+    ports, the name of each device is added to the output name.
+    """
+    prefix, extention = splitName(args.out)
+    init_date = strftime("%Y-%m-%d %H:%M:%S", localtime())
+    ports = args.port
+    if ports == None: ports = [None]
+    sessions = []
+    try:
+        for port in ports:
+            port = openDevice(port)
+            name = prefix
+            if len(ports) > 1: name = "%s_%s" % (prefix, deviceSuffix(port))
+            session = DeviceSession(port, name, extention, init_date, args.buffer, args.save_interval, channels = args.channels)
+            sessions.append(session)
+            session.checkFilesExists()
+        for session in sessions:
+            session.writeParams("Connected to device in port, %s" % session.port)
+            session.writeParams("Data columns, %s" % session.data_ring.header)
+            sampling, coincidence = session.configure(args.sampling, args.coincidence)
+    except BaseException:
+        for session in sessions:
+            session.close()
+        raise
+
+    init_time = time()
+    for session in sessions:
+        session.start(init_time)
+    refresh = max(sampling, constants.DATA_REFRESH_RATE) / 1000 # seconds
+    error = None
+    try:
+        while (args.duration == 0) or (time() - init_time < args.duration):
+            sleep(refresh)
+            for session in sessions:
+                rows = session.update()
+                if (rows is not None) and not args.quiet:
+                    label = ""
+                    if len(sessions) > 1: label = session.port + constants.DELIMITER
+                    print(label + session.data_ring.fmt % tuple(rows[-1]))
+                error = session.getError()
+                if error != None:
+                    session.writeParams("Error,%s" % error)
+                    break
+            if error != None: break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for session in sessions:
+            session.stop()
+            session_error = session.getError()
+            if session_error != None:
+                session.writeParams("Error,%s" % session_error)
+                error = error or session_error
+            session.close()
+    if error != None:
+        raise error
+    for session in sessions:
+        print("Saved %d rows to %s" % (session.data_ring.total_rows, session.results_files.data_file.name))
+
+def sweepRange(start, stop, step, maximum):
+    values = np.arange(start, stop + 1, step)
+    return values[values <= maximum]
+
+def checkChannels(channels, n_channels):
+    letters = [chr(i + ord('A')) for i in range(n_channels)]
+    for channel in channels:
+        if channel not in letters:
+            raise ValueError("%s is not a channel of a %d channel device." % (channel, n_channels))
+
+def sectionRunner(section, port):
+    """
+    Returns the runner of the sweep described by a section of a parameter
+    file. The sampling time and coincidence window of the section are
+    written to the device.
+    """
+    limits = abacus.constants
+    n_channels = abacus.getChannelsFromName(port)
+    kind = section.get("type", "delay").lower()
+    channel1 = section.get("channel1", "A").upper()
+    channel2 = section.get("channel2", "B").upper()
+    if "output" not in section:
+        raise ValueError("no output file was given.")
+    output = section["output"]
+    resume = section.getboolean("resume", False)
+    if not resume:
+        File(output).checkFileExists()
+
+    with portLock(port):
+        if "sampling" in section:
+            abacus.setSetting(port, 'sampling', section.getint("sampling"))
+        if "coincidence" in section:
+            abacus.setSetting(port, 'coincidence_window', section.getint("coincidence"))
+        sampling = abacus.getSetting(port, 'sampling')
+
+    dimensions = 1
+    finest = None
+    if kind == "delay":
+        others = [channel2]
+        if channel2 == "ALL":
+            others = [chr(i + ord('A')) for i in range(n_channels) if chr(i + ord('A')) != channel1]
+        checkChannels([channel1] + others, n_channels)
+        channels, header, make_steps = delaySweep(channel1, others)
+        points = sweepRange(section.getint("start", -limits.DELAY_MAXIMUM_VALUE), section.getint("stop", limits.DELAY_MAXIMUM_VALUE),
+                            section.getint("step", limits.DELAY_STEP_VALUE), limits.DELAY_MAXIMUM_VALUE)
+        if section.getboolean("adaptive", False):
+            finest = limits.DELAY_STEP_VALUE
+    elif kind == "sleep":
+        checkChannels([channel1], n_channels)
+        channels, header, make_steps = sleepSweep(channel1)
+        points = sweepRange(section.getint("start", limits.SLEEP_MINIMUM_VALUE), section.getint("stop", limits.SLEEP_MAXIMUM_VALUE),
+                            section.getint("step", limits.SLEEP_STEP_VALUE), limits.SLEEP_MAXIMUM_VALUE)
+    elif kind == "grid":
+        checkChannels([channel1, channel2], n_channels)
+        if section.get("setting", "sleep").lower().startswith("sleep"):
+            setting = SLEEP
+            minimum, maximum, step = limits.SLEEP_MINIMUM_VALUE, limits.SLEEP_MAXIMUM_VALUE, limits.SLEEP_STEP_VALUE
+        else:
+            setting = COINCIDENCE_WINDOW
+            minimum, maximum, step = limits.COINCIDENCE_WINDOW_MINIMUM_VALUE, limits.COINCIDENCE_WINDOW_MAXIMUM_VALUE, \
+                                        limits.COINCIDENCE_WINDOW_STEP_VALUE
+        channels, header, make_steps = gridSweep(channel1, channel2, setting)
+        delays = sweepRange(section.getint("start", -limits.DELAY_MAXIMUM_VALUE), section.getint("stop", limits.DELAY_MAXIMUM_VALUE),
+                            section.getint("step", limits.DELAY_STEP_VALUE), limits.DELAY_MAXIMUM_VALUE)
+        values = sweepRange(section.getint("start2", minimum), section.getint("stop2", maximum), section.getint("step2", step), maximum)
+        points = gridPoints(delays, values)
+        dimensions = 2
+    else:
+        raise ValueError("%s is not a sweep type, use delay, sleep or grid." % kind)
+    if len(points) == 0:
+        raise ValueError("the sweep has no points.")
+    n = section.getint("n", 1)
+    if n < 1:
+        raise ValueError("n must be at least 1, it is %d." % n)
+
+    return SweepRunner(port, points, channels, n, sampling, make_steps, header, output,
+                        section.getint("target", constants.SWEEP_TARGET_COUNTS), dimensions, finest, resume)
+
+def runSections(parser, names, port, errors, runners):
+    "Runs the sweeps of names on port one after the other, the settings they change are set back afterwards"
+    for name in names:
+        runner = None
+        try:
+            runner = sectionRunner(parser[name], port)
+            runners.append(runner)
+            with portLock(port):
+                original = dict((setting, abacus.getSetting(port, setting)) for setting in runner.make_steps(runner.points[:1])[0])
+            runner.run()
+            with portLock(port):
+                for (setting, value) in original.items():
+                    abacus.setSetting(port, setting, value)
+            errors[name] = runner.error
+            if runner.error == None:
+                print("%s: %d points saved to %s" % (name, len(runner.results), runner.file_name))
+        except Exception as e:
+            errors[name] = e
+        if (runner != None) and runner.sweep.isStopped(): break
+
+def sweepFile(file_name, sections = None):
+    """
+    Runs the sweeps described in a parameter file, one per section, and
+    returns the error of every sweep (None when it ended well). Sweeps on
+    different devices run at the same time, the ones on the same device one
+    after the other. Keys of the DEFAULT section are shared by every sweep:
+
+        [DEFAULT]
+        port = /dev/ttyACM0
+        sampling = 100
+        n = 5
+
+        [delay AB]
+        type = delay        ; delay, sleep or grid
+        channel1 = A
+        channel2 = B        ; All sweeps every other channel against channel1
+        start = -100
+        stop = 100
+        step = 5
+        adaptive = no
+        output = delay_AB.csv
+        resume = no
+
+    Sleep sweeps use channel1; grid sweeps add setting (sleep or
+    coincidence_window), start2, stop2 and step2. coincidence and target
+    (counts per step) are optional.
+    """
+    parser = configparser.ConfigParser(inline_comment_prefixes = (";", "#"))
+    if len(parser.read(file_name)) == 0:
+        raise FileNotFoundError("%s could not be read." % file_name)
+    if sections == None:
+        sections = parser.sections()
+    groups = {}
+    for name in sections:
+        if not parser.has_section(name):
+            raise ValueError("%s has no sweep named %s." % (file_name, name))
+        groups.setdefault(parser[name].get("port"), []).append(name)
+
+    errors = {}
+    runners = []
+    threads = []
+    ports = []
+    try:
+        for (port, names) in groups.items():
+            port = openDevice(port)
+            ports.append(port)
+            thread = Thread(target = runSections, args = (parser, names, port, errors, runners))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        for runner in runners:
+            runner.stop()
+        for thread in threads:
+            thread.join()
+    finally:
+        for port in ports:
+            abacus.close(port)
+    return dict((name, errors.get(name)) for name in sections if name in errors)
+
+def sweep(args):
+    errors = sweepFile(args.parameters, args.sections)
+    failed = [name for name in errors if errors[name] != None]
+    for name in failed:
+        print("%s: error: %s" % (name, errors[name]))
+    return len(failed)
+
+def addAcquireParser(subparsers):
+    parser = subparsers.add_parser("acquire", help = "record counts to a file")
+    parser.add_argument("--port", nargs = "+", help = "device names or serial ports, the first device found by default")
+    parser.add_argument("--sampling", type = int, help = "sampling time (ms)")
+    parser.add_argument("--coincidence", type = int, help = "coincidence window (ns)")
+    parser.add_argument("--duration", type = float, default = 0, help = "seconds to record, 0 records until interrupted")
+    parser.add_argument("--out", required = True, help = "output file, its extension (%s) sets the format" % ", ".join(constants.SUPPORTED_EXTENSIONS))
+    parser.add_argument("--channels", nargs = "+", help = "combinations to store, every single and pair by default")
+    parser.add_argument("--buffer", type = int, default = constants.BUFFER_ROWS, help = "rows kept in memory")
+    parser.add_argument("--save-interval", type = float, default = constants.SAVE_INTERVAL,
+                        help = "longest time rows stay in memory before being saved (s)")
+    parser.add_argument("--quiet", action = "store_true", help = "do not print the rows")
+    parser.set_defaults(function = acquire)
+
+def addSweepParser(subparsers):
+    parser = subparsers.add_parser("sweep", help = "run the sweeps of a parameter file",
+                                    description = "Runs the sweeps of a parameter file, one per section.")
+    parser.add_argument("parameters", help = "parameter file, see abacusSoftware.cli.sweepFile for its keys")
+    parser.add_argument("--sections", nargs = "+", help = "sweeps to run, every section by default")
+    parser.set_defaults(function = sweep)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "abacusSoftware", description = constants.WINDOW_NAME)
+    parser.add_argument("--version", action = "version", version = constants.__version__)
+    subparsers = parser.add_subparsers(title = "commands")
+    addAcquireParser(subparsers)
+    addSweepParser(subparsers)
+    args = parser.parse_args(argv)
+
+    if not hasattr(args, "function"):
+        from abacusSoftware.main import run
+        run()
+        return
+    try:
+        failed = args.function(args)
+    except (abacus.BaseError, SerialException, OSError, ValueError, configparser.Error) as e:
+        parser.exit(1, "%s: error: %s\n" % (parser.prog, e))
+    if failed:
+        parser.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ CURRENT_OS = sys.platform
 DIRECTORY = os.path.dirname(sys.executable)
 SETTINGS_PATH = os.path.join(DIRECTORY, "settings.py")
 LOGFILE_PATH = "logfile.txt"
+UPDATE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".abacusSoftware_update") # last version found online
+UPDATE_TIMEOUT = 3 # longest wait for the version check (s)
+UPDATE_CHECK_INTERVAL = 86400 # time the last version found online is trusted (s)
 # LOGFILE_PATH = os.path.join(DIRECTORY, "logfile.txt")
 
 if abacus.constants.DEBUG:
@@ -23,7 +26,8 @@ EXTENSION_DATA = '.dat'
 PARAMS_SUFFIX = "_settings"
 FILE_PREFIX = "abacusdata"
 EXTENSION_PARAMS = PARAMS_SUFFIX + '.txt'
-SUPPORTED_EXTENSIONS = {'.dat': 'Plain text data file (*.dat)', '.csv' : 'CSV data files (*.csv)'}
+SUPPORTED_EXTENSIONS = {'.dat': 'Plain text data file (*.dat)', '.csv' : 'CSV data files (*.csv)', '.npy' : 'Binary NumPy data files (*.npy)'}
+BINARY_EXTENSIONS = ['.npy']
 
 DELIMITER = ","
 DELIMITERS = [",", ";", "Tab", "Space"]
@@ -37,8 +41,29 @@ WINDOW_NAME = "Tausand Abacus Sofware %s"%__version__
 
 DATA_REFRESH_RATE = 250 # fastest data refresh rate (ms)
 CHECK_RATE = 250
-
-BUFFER_ROWS = 10000
+SETTINGS_POLL_INTERVAL = 10 # longest time between two reads of the device settings (s), 0 reads them only after a change
+SETTINGS_POLL_INTERVAL_MAXIMUM = 3600
+SETTINGS_WRITE_DELAY = 200 # time a changed setting waits for further changes before it is written (ms)
+ACQUISITION_MIN_WAIT = 1e-3 # shortest wait between two polls of the device (s)
+SWEEP_VERIFY = False # read back every setting written by a sweep
+SWEEP_TARGET_COUNTS = 0 # counts that end a sweep step before all its measurements, 0 takes all of them
+SWEEP_ZOOM = 5 # step ratio between two passes of an adaptive sweep
+
+BUFFER_ROWS = 10000 # rows kept in memory
+ID_DTYPE = "u4"
+COUNTS_DTYPE = "u4" # counters of the devices are 32 bits wide
+BUFFER_ROWS_MINIMUM = 100
+BUFFER_ROWS_MAXIMUM = 10 ** 7
+SAVE_INTERVAL = 60 # longest time rows stay in memory before being saved (s), 0 saves only when the buffer is full
+SAVE_INTERVAL_MAXIMUM = 86400
+COMPACT_COLUMNS = False # store only the enabled combinations
+KEEP_HISTORY = False # spill saved rows to a memory-mapped file so the plot can show the whole session
+PLOT_SYMBOL_LIMIT = 500 # points in a line above which its symbols are not drawn
+
+FILE_BUFFER_SIZE = 2 ** 16 # bytes held in memory before they are written to disk
+FILE_FLUSH_ROWS = 10000 # rows written before the file is flushed
+FILE_FLUSH_INTERVAL = 10 # longest time between flushes (s)
+WRITER_QUEUE_SIZE = 16 # saves waiting to be written before the acquisition has to wait
 
 COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#8c564b",
         "#e377c2", "#7f7f7f", "#bcdb22", "#14becf"]
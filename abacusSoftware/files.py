@@ -1,20 +1,59 @@
 import os
+import struct
+import tempfile
 import numpy as np
-from time import localtime, strftime
+from queue import Queue
+from collections import deque
+from threading import Thread
+from time import time, localtime, strftime
 
 import abacusSoftware.constants as constants
 
 class File(object):
+    """
+    Output file that keeps one handle open for the session. Lines go through
+    a write buffer of `constants.FILE_BUFFER_SIZE` bytes, and the buffer is
+    flushed every `constants.FILE_FLUSH_ROWS` rows or
+    `constants.FILE_FLUSH_INTERVAL` seconds, whichever comes first.
+    """
+    BINARY = False
+
     def __init__(self, name, header = None):
         self.name = name
         self.header = header
         self.lines_written = 0
+        self.handle = None
+        self.unflushed_rows = 0
+        self.last_flush = time()
+
+    def open(self):
+        if self.handle == None:
+            self.handle = open(self.name, "a", buffering = constants.FILE_BUFFER_SIZE, newline = "")
+        return self.handle
+
+    def checkFlush(self, rows):
+        self.unflushed_rows += rows
+        if (self.unflushed_rows >= constants.FILE_FLUSH_ROWS) or \
+                (time() - self.last_flush >= constants.FILE_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        if self.handle != None:
+            self.handle.flush()
+        self.unflushed_rows = 0
+        self.last_flush = time()
+
+    def close(self):
+        if self.handle != None:
+            self.flush()
+            self.handle.close()
+            self.handle = None
 
     def checkFileExists(self, name = None):
         if name == None:
             name = self.name
         if os.path.isfile(name):
-            raise FileExistsError()
+            raise FileExistsError("%s already exists." % name)
 
     def isEmpty(self):
         if self.lines_written > 0:
@@ -22,25 +61,27 @@ class File(object):
         return True
 
     def write(self, data):
-        with open(self.name, "a") as file:
-            if self.header != None:
-                file.write(self.header + constants.BREAKLINE)
-                self.header = None
+        file = self.open()
+        if self.header != None:
+            file.write(self.header + constants.BREAKLINE)
+            self.header = None
 
-            file.write(data + constants.BREAKLINE)
-            self.lines_written += 1
+        file.write(data + constants.BREAKLINE)
+        self.lines_written += 1
+        self.checkFlush(1)
 
     def npwrite(self, data, fmt):
+        file = self.open()
         if self.header != None:
-            with open(self.name, "a") as file:
-                file.write(self.header + constants.BREAKLINE)
-                self.header = None
-        with open(self.name, 'ab') as f:
-            np.savetxt(f, data, fmt=fmt, newline=constants.BREAKLINE)
+            file.write(self.header + constants.BREAKLINE)
+            self.header = None
+        np.savetxt(file, data, fmt=fmt, newline=constants.BREAKLINE)
         self.lines_written += data.shape[0]
+        self.checkFlush(data.shape[0])
 
     def changeName(self, name):
         # self.checkFileExists(name)
+        self.close()
         if not self.isEmpty():
             os.rename(self.name, name)
         self.name = name
@@ -49,12 +90,122 @@ class File(object):
         if self.header != None:
             self.header = header
 
+    def changeColumns(self, header):
+        "Rows written next have other columns, their header is repeated before them"
+        self.header = header
+
     def delete(self):
+        self.close()
         try:
             os.remove(self.name)
         except Exception as e:
             print(e)
 
+class NpyFile(File):
+    """
+    NumPy binary file (.npy) that grows by appending rows. The header is
+    padded to fit any number of rows, so a write only appends the raw rows
+    and the shape is rewritten when the file is flushed. Rows are structured
+    arrays, the field names keep the column names.
+    """
+    BINARY = True
+    MAX_ROWS = 10 ** 19
+
+    def __init__(self, name, header = None):
+        super(NpyFile, self).__init__(name, header)
+        self.dtype = None
+        self.header_length = 0
+
+    def headerText(self, rows):
+        descr = np.lib.format.dtype_to_descr(self.dtype)
+        return "{'descr': %s, 'fortran_order': False, 'shape': (%d,), }" % (repr(descr), rows)
+
+    def headerBytes(self, rows):
+        text = self.headerText(rows).ljust(self.header_length - 11) + "\n"
+        return np.lib.format.magic(1, 0) + struct.pack("<H", len(text)) + text.encode("latin1")
+
+    def start(self, dtype):
+        "Creates the file, or continues an existing one holding the same columns"
+        self.dtype = dtype
+        if os.path.isfile(self.name):
+            with open(self.name, "rb") as file:
+                version = np.lib.format.read_magic(file)
+                if version == (1, 0):
+                    shape, fortran_order, old_dtype = np.lib.format.read_array_header_1_0(file)
+                else:
+                    shape, fortran_order, old_dtype = np.lib.format.read_array_header_2_0(file)
+                offset = file.tell()
+            if (old_dtype != dtype) or (len(shape) != 1) or (len(self.headerText(self.MAX_ROWS)) + 11 > offset):
+                raise FileExistsError("%s holds data that can not be extended." % self.name)
+            self.header_length = offset
+            self.lines_written = shape[0]
+        else:
+            length = len(self.headerText(self.MAX_ROWS)) + 11
+            self.header_length = length + (-length % np.lib.format.ARRAY_ALIGN)
+            with open(self.name, "wb") as file:
+                file.write(self.headerBytes(0))
+        self.header = None
+
+    def open(self):
+        if self.handle == None:
+            self.handle = open(self.name, "r+b", buffering = constants.FILE_BUFFER_SIZE)
+            self.handle.seek(0, 2)
+        return self.handle
+
+    def flush(self):
+        if self.handle != None:
+            self.handle.seek(0)
+            self.handle.write(self.headerBytes(self.lines_written))
+            self.handle.seek(0, 2)
+        super(NpyFile, self).flush()
+
+    def changeColumns(self, header):
+        "A .npy file holds one set of columns, rows with other columns continue on a new file"
+        if not self.isEmpty():
+            self.close()
+            base, ext = os.path.splitext(self.name)
+            i = 2
+            while os.path.isfile("%s_%d%s" % (base, i, ext)):
+                i += 1
+            self.name = "%s_%d%s" % (base, i, ext)
+            self.lines_written = 0
+        elif self.header == None:
+            "started without rows, it is created again with the new columns"
+            self.delete()
+        self.header = header
+
+    def write(self, data):
+        raise TypeError("Text can not be written to a binary data file.")
+
+    def npwrite(self, data, fmt = None):
+        if self.header != None:
+            self.start(data.dtype)
+        file = self.open()
+        file.write(np.ascontiguousarray(data, dtype = self.dtype).tobytes())
+        self.lines_written += data.shape[0]
+        self.checkFlush(data.shape[0])
+
+def dataFileClass(data_extention):
+    if data_extention in constants.BINARY_EXTENSIONS:
+        return NpyFile
+    return File
+
+def exportText(name, text_name = None, delimiter = constants.DELIMITER):
+    """
+    Writes the rows of a binary data file with the plain text layout of the
+    .dat/.csv files. Returns the name of the text file.
+    """
+    if text_name == None:
+        text_name = os.path.splitext(name)[0] + ".csv"
+    data = np.load(name, mmap_mode = "r")
+    names = data.dtype.names
+    fmt = delimiter.join(["%.3f"] + ["%d" for i in range(len(names) - 1)])
+    file = File(text_name, delimiter.join(names))
+    for i in range(0, data.shape[0], constants.BUFFER_ROWS):
+        file.npwrite(data[i : i + constants.BUFFER_ROWS], fmt)
+    file.close()
+    return text_name
+
 class ResultsFiles(object):
     def __init__(self, prefix, data_extention, time):
         self.prefix = prefix
@@ -62,11 +213,16 @@ class ResultsFiles(object):
         self.data_name = self.prefix + self.data_extention
         self.params_name = self.prefix + constants.EXTENSION_PARAMS
 
-        self.data_file = File(name = self.data_name, header = constants.DELIMITER.join(["Time (s)", "Counts A", "Counts B", "Coincidences AB"]))
+        self.data_file = dataFileClass(data_extention)(name = self.data_name, header = constants.DELIMITER.join(["Time (s)", "Counts A", "Counts B", "Coincidences AB"]))
         self.params_file = File(name = self.params_name, header = constants.PARAMS_HEADER%time)
 
     def changeName(self, prefix, data_extention):
-        self.data_file.changeName(prefix + data_extention)
+        if dataFileClass(data_extention) is type(self.data_file):
+            self.data_file.changeName(prefix + data_extention)
+        else:
+            self.data_file.close() # flushes the buffered rows
+            self.data_file = dataFileClass(data_extention)(name = prefix + data_extention, header = constants.DELIMITER.join(["Time (s)", "Counts A", "Counts B", "Coincidences AB"]))
+        self.data_extention = data_extention
         self.params_file.changeName(prefix + constants.EXTENSION_PARAMS)
 
     def getNames(self):
@@ -75,6 +231,14 @@ class ResultsFiles(object):
     def areEmpty(self):
         return self.data_file.isEmpty() & self.params_file.isEmpty()
 
+    def flush(self):
+        self.data_file.flush()
+        self.params_file.flush()
+
+    def close(self):
+        self.data_file.close()
+        self.params_file.close()
+
     def writeData(self, text):
         self.data_file.write(text)
 
@@ -87,27 +251,154 @@ class ResultsFiles(object):
         self.data_file.checkFileExists()
         self.params_file.checkFileExists()
 
+class Writer(object):
+    """
+    Runs file operations on a background thread, in the order they were put.
+    `put` blocks while `constants.WRITER_QUEUE_SIZE` operations are pending,
+    so a slow disk holds back the caller instead of growing memory. Errors
+    are kept in `errors` until `getError` pops them.
+    """
+    def __init__(self):
+        self.queue = Queue(maxsize = constants.WRITER_QUEUE_SIZE)
+        self.errors = deque()
+        self.thread = None
+
+    def put(self, method, *args):
+        if self.thread == None:
+            self.thread = Thread(target = self.heavyDuty)
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put((method, args))
+
+    def join(self):
+        "Waits until every pending operation is done"
+        if self.thread != None:
+            self.queue.join()
+
+    def stop(self):
+        if self.thread != None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def getError(self):
+        if len(self.errors):
+            return self.errors.popleft()
+        return None
+
+    def heavyDuty(self):
+        while True:
+            item = self.queue.get()
+            if item == None:
+                self.queue.task_done()
+                break
+            method, args = item
+            try:
+                method(*args)
+            except Exception as e:
+                self.errors.append(e)
+            self.queue.task_done()
+
+class History(object):
+    """
+    Rows saved from a RingBuffer, spilled to a temporary .npy file. They are
+    read back memory-mapped, so the whole session can be plotted without
+    holding it in memory. `npwrite` and `clear` run on the writer thread.
+    """
+    def __init__(self):
+        handle, self.name = tempfile.mkstemp(prefix = constants.FILE_PREFIX + "_history_", suffix = ".npy")
+        os.close(handle)
+        os.remove(self.name)
+        self.file = NpyFile(self.name, header = "")
+        self.rows = 0
+        self.start = 0
+        self.map = None
+
+    def npwrite(self, data, fmt = None):
+        self.file.npwrite(data)
+        self.file.flush()
+        self.rows = self.file.lines_written
+
+    def clear(self):
+        self.start = self.rows
+
+    def read(self):
+        "Returns the spilled rows memory-mapped, None if there are none"
+        rows = self.rows
+        if rows == self.start:
+            return None
+        if (self.map is None) or (self.map.shape[0] != rows):
+            self.map = np.load(self.name, mmap_mode = "r")
+        return self.map[self.start : rows]
+
+    def delete(self):
+        self.map = None
+        self.file.delete()
+
 class RingBuffer():
     """
     Based on https://scimusing.wordpress.com/2013/10/25/ring-buffers-in-pythonnumpy/
+
+    Rows are stored oldest first starting at a moving physical position.
+    Indexing and slicing work on that logical order and return views of
+    `data` whenever the requested rows do not cross the end of the array.
+
+    `data` is a structured array: a float64 time, an unsigned ID and one
+    `counts_dtype` field per combination, named after the file header.
     """
-    def __init__(self, rows, columns, combinations, file = None):
-        self.data = np.zeros((rows, columns))
-        self.index = 0
+    def __init__(self, rows, combinations, file = None, save_interval = 0, history = False,
+                    counts_dtype = constants.COUNTS_DTYPE):
         self.file = file
         self.combinations = combinations
-        self.data_fmt = ["%.3f"] + ["%d" for i in range(columns - 1)]
-        self.fmt = constants.DELIMITER.join(self.data_fmt)
-        self.size = self.data.shape[0]
-        self.total_movements = 0
-        self.last_saved = 0
         self.header_list = ["Time (s)", "ID"] + ["Counts %s"%letter for letter in self.combinations]
         self.header = constants.DELIMITER.join(self.header_list)
+        self.dtype = np.dtype([(self.header_list[0], "f8"), (self.header_list[1], constants.ID_DTYPE)] + \
+                                [(name, counts_dtype) for name in self.header_list[2:]])
+        self.data_fmt = ["%.3f"] + ["%d" for name in self.header_list[1:]]
+        self.fmt = constants.DELIMITER.join(self.data_fmt)
+        self.data = np.zeros(rows, dtype = self.dtype)
+        self.index = 0 # physical row where the next row is written
+        self.size = self.data.shape[0]
+        self.rows = 0 # rows held, at most size
+        self.total_rows = 0 # rows written since the last clear
+        self.last_saved = 0 # value of total_rows on the last save
+        self.save_interval = save_interval
+        self.last_save_time = time()
+        self.writer = Writer()
+        self.history = None
+        self.history_start = None # row count before the first row of the history, set by its first save
+        self.setHistory(history)
 
     def clear(self):
         self.index = 0
-        self.total_movements = 0
+        self.rows = 0
+        self.total_rows = 0
         self.last_saved = 0
+        self.history_start = None
+        if self.history != None:
+            self.writer.put(self.history.clear)
+
+    def setHistory(self, history):
+        "Starts or ends spilling saved rows to disk, a new history starts with the next save"
+        if history and (self.history == None):
+            self.history = History()
+            self.history_start = None
+        elif (not history) and (self.history != None):
+            self.join()
+            self.history.delete()
+            self.history = None
+
+    def resize(self, rows):
+        "Changes the capacity, keeping the newest rows"
+        self.save()
+        count = min(len(self), rows)
+        data = np.zeros(rows, dtype = self.dtype)
+        if count:
+            data[:count] = self[-count:]
+        self.data = data
+        self.size = rows
+        self.rows = count
+        self.index = count % rows
 
     def isEmpty(self):
         if self.last_saved == 0: return True
@@ -120,35 +411,100 @@ class RingBuffer():
             self.file.updateHeader(header = self.header)
 
     def extend(self, x):
-        "adds array x to ring buffer"
-        self.total_movements += 1
-        x_index = (self.index + np.arange(x.shape[0])) % self.size
-        self.data[x_index] = x
-        self.index = x_index[-1] + 1
-        if self.index == self.size:
+        "adds the rows of the structured array x to ring buffer"
+        n = x.shape[0]
+        start = 0
+        while start < n:
+            stop = min(n, start + self.size - self.index)
+            self.data[self.index : self.index + stop - start] = x[start : stop]
+            self.index += stop - start
+            self.rows = min(self.rows + stop - start, self.size)
+            self.total_rows += stop - start
+            if self.index == self.size:
+                self.save()
+                self.index = 0
+            start = stop
+        if self.save_interval and (time() - self.last_save_time >= self.save_interval):
             self.save()
 
+    def segments(self):
+        "Returns the stored rows as two views, the oldest ones first"
+        start = self.index - len(self)
+        if start >= 0:
+            return self.data[start : self.index], self.data[:0]
+        return self.data[self.size + start:], self.data[:self.index]
+
     def get(self):
         "Returns the first-in-first-out data in the ring buffer"
-        idx = (self.index + np.arange(self.size)) %self.size
-        return self.data[idx]
+        return np.concatenate(self.segments())
+
+    def lastRow(self):
+        "Returns a view of the newest row, None if the buffer is empty"
+        if len(self) == 0: return None
+        return self.data[self.index - 1]
 
     def setFile(self, file):
         self.file = file
         self.file.updateHeader(self.header)
 
     def save(self):
-        "Saves the buffer"
-        if (self.file != None) and (self.index != self.last_saved):
-            from_index = self.size - self.index + self.last_saved
-            self.last_saved = self.index
-            data = self.get()[from_index%self.size:]
-            self.file.npwrite(data, self.fmt)
-        else:
+        "Copies the unsaved rows and queues them to be written by the writer thread"
+        self.last_save_time = time()
+        if (self.file != None) or (self.history != None):
+            unsaved = min(self.total_rows - self.last_saved, len(self))
+            if unsaved > 0:
+                data = np.array(self[-unsaved:])
+                if self.file != None:
+                    self.writer.put(self.file.npwrite, data, self.fmt)
+                if self.history != None:
+                    if self.history_start == None:
+                        self.history_start = self.total_rows - unsaved
+                    self.writer.put(self.history.npwrite, data)
+            self.last_saved = self.total_rows
+        if self.file == None:
             print("No file has been specified.")
 
+    def getHistory(self):
+        "Returns the spilled rows that are no longer in the buffer, None if there are none"
+        if (self.history == None) or (self.history_start == None):
+            return None
+        data = self.history.read()
+        if data is None:
+            return None
+        older = min(data.shape[0], self.total_rows - len(self) - self.history_start)
+        if older <= 0:
+            return None
+        return data[:older]
+
+    def join(self):
+        "Waits until every saved row has been written"
+        self.writer.join()
+
+    def close(self):
+        self.writer.stop()
+        if self.history != None:
+            self.history.delete()
+
+    def __len__(self):
+        return self.rows
+
     def __getitem__(self, item):
-        if self.total_movements > self.size:
-            return self.get()
-        else:
-            return self.get()[self.size-self.index :]
+        if isinstance(item, str):
+            return self[:][item]
+
+        count = len(self)
+        first = self.index - count
+        if isinstance(item, slice):
+            start, stop, step = item.indices(count)
+            if step != 1:
+                return self.data[(first + np.arange(start, stop, step)) % self.size]
+            n = max(stop - start, 0)
+            start = (first + start) % self.size
+            if start + n <= self.size:
+                return self.data[start : start + n]
+            return np.concatenate((self.data[start:], self.data[:start + n - self.size]))
+
+        if item < 0: item += count
+        if (item < 0) or (item >= count):
+            raise IndexError("RingBuffer index out of range")
+        return self.data[(first + item) % self.size]
@@ -0,0 +1,83 @@
+import numpy as np
+
+FWHM_SIGMA = 2 * np.sqrt(2 * np.log(2)) # full width at half maximum of a gaussian of unit sigma
+
+def spacedMedian(x, y):
+    """
+    Median of every column of y with each point weighted by the delay span it
+    covers, so the dense points that adaptive sweeps put on the peak count as
+    much as the sparse ones on the tails. x is sorted.
+    """
+    if len(x) < 2:
+        return np.median(y, axis = 0)
+    edges = np.concatenate(([x[0]], (x[1:] + x[:-1]) / 2, [x[-1]]))
+    spans = np.diff(edges)
+    if spans.sum() <= 0:
+        return np.median(y, axis = 0)
+    order = np.argsort(y, axis = 0, kind = "stable")
+    cumulative = np.cumsum(spans[order], axis = 0)
+    half = np.argmax(cumulative >= cumulative[-1] / 2, axis = 0)
+    return np.take_along_axis(y, order, axis = 0)[half, np.arange(y.shape[1])]
+
+def fitPeaks(x, y):
+    """
+    Fits a peak over a constant background on every column of y, all columns
+    at once. The background is the median of the column weighted by the
+    spacing of x, which holds the accidental coincidences when the peak is
+    narrower than half the span of the sweep.
+    A gaussian is fitted to the points above half of the peak by weighted
+    least squares on the logarithm of the counts; when those points do not
+    make a peak (a flat, top-hat like top, where the fitted gaussian comes
+    out wider than the points themselves) the center is their centroid and
+    the width their extent.
+
+    Returns the center, full width at half maximum, height above the
+    background and background of every column.
+    """
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float).reshape((len(x), -1))
+    order = np.argsort(x)
+    x = x[order]
+    y = y[order]
+
+    background = spacedMedian(x, y)
+    signal = y - background
+    height = signal.max(axis = 0)
+    top = (signal > height / 2) & (height > 0)
+
+    total = np.where(top, signal, 0).sum(axis = 0)
+    total[total == 0] = 1
+    centroid = (np.where(top, signal, 0) * x[:, None]).sum(axis = 0) / total
+    step = np.min(np.diff(x)) if len(x) > 1 else 0
+    extent = np.where(top, x[:, None], -np.inf).max(axis = 0) - np.where(top, x[:, None], np.inf).min(axis = 0) + step
+    scale = np.where(np.isfinite(extent) & (extent > 0), extent, 1)
+
+    "x is centered and scaled on each column to keep the normal equations well conditioned"
+    u = (x[:, None] - centroid) / scale
+    weights = (np.where(top, signal, 0) / np.where(height > 0, height, 1)) ** 2 # inverse variance of the logarithm
+    log_signal = np.log(np.where(top, signal, 1))
+    powers = u[..., None] ** np.arange(3)
+    a = np.einsum("ic,icj,ick->cjk", weights, powers, powers)
+    b = np.einsum("ic,icj,ic->cj", weights, powers, log_signal)
+    solvable = top.sum(axis = 0) >= 3
+    a[~solvable] = np.eye(3)
+    coefficients = np.linalg.solve(a, b[..., None])[..., 0]
+    c1 = coefficients[:, 1]
+    c2 = coefficients[:, 2]
+    peaked = solvable & (c2 < 0)
+    c2 = np.where(peaked, c2, -1)
+
+    center = np.where(peaked, centroid - scale * c1 / (2 * c2), centroid)
+    width = np.where(peaked, FWHM_SIGMA * scale * np.sqrt(-1 / (2 * c2)), extent)
+    "a gaussian wider than the points above half maximum is a flat top, its curvature is roundoff"
+    flat = width > extent + step
+    center = np.where(flat, centroid, center)
+    width = np.where(flat, extent, width)
+    "a gaussian fitted outside of the sweep is not trusted"
+    outside = (center < x[0]) | (center > x[-1])
+    center = np.where(outside, centroid, center)
+    width = np.where(outside, extent, width)
+    empty = height <= 0
+    center[empty] = np.nan
+    width[empty] = np.nan
+    return center, width, height, background
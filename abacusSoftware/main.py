@@ -2,13 +2,12 @@ import os
 import re
 import sys
 import traceback
+import webbrowser
 import qdarkstyle
 import numpy as np
-import abacusSoftware.__GUI_images__
 import pyqtgraph as pg
 from datetime import datetime
-from itertools import combinations
-from time import time, localtime, strftime, sleep
+from time import time, localtime, strftime
 
 from serial.serialutil import SerialException, SerialTimeoutException
 
@@ -24,25 +23,21 @@ import abacusSoftware.constants as constants
 import abacusSoftware.common as common
 import abacusSoftware.builtin as builtin
 import abacusSoftware.url as url
+import abacusSoftware.resources as resources
 from abacusSoftware.menuBar import AboutWindow
 from abacusSoftware.exceptions import ExtentionError
-from abacusSoftware.files import ResultsFiles, RingBuffer
+from abacusSoftware.files import ResultsFiles, RingBuffer, exportText
+from abacusSoftware.acquisition import AcquisitionWorker, SettingsCache, SettingsQueue, \
+    getCombinations, settingLabel
+from abacusSoftware.session import DeviceSession, deviceSuffix
 from abacusSoftware.supportWidgets import Table, CurrentLabels, ConnectDialog, \
-    SettingsDialog, SubWindow, ClickableLineEdit, Tabs, SamplingWidget
+    SettingsDialog, SubWindow, ClickableLineEdit, Tabs, SamplingWidget, DevicePlot
 
 import pyAbacus as abacus
 
 STDOUT = None
 
 
-def getCombinations(n_channels):
-    letters = [chr(i + ord('A')) for i in range(n_channels)]
-    joined = "".join(letters)
-    for i in range(2, n_channels + 1):
-        letters += ["".join(pair) for pair in combinations(joined, i)]
-    return letters
-
-
 common.readConstantsFile()
 
 
@@ -155,10 +150,15 @@ class MainWindow(QMainWindow):
         Plot
         """
         self.plot_lines = []
+        self.history_lines = []
+        self.plotted_rows = 0
+        self.plotted_history = 0
         self.legend = None
         self.counts_plot = self.plot_win.addPlot()
         self.counts_plot.setLabel('left', "Counts")
         self.counts_plot.setLabel('bottom', "Time", units='s')
+        self.counts_plot.setDownsampling(auto=True, mode='peak')
+        self.counts_plot.setClipToView(True)
 
         self.refresh_timer = QtCore.QTimer()
         self.refresh_timer.setInterval(constants.DATA_REFRESH_RATE)
@@ -172,14 +172,30 @@ class MainWindow(QMainWindow):
         self.check_timer.setInterval(constants.CHECK_RATE)
         self.check_timer.timeout.connect(self.checkParams)
 
+        self.write_timer = QtCore.QTimer()
+        self.write_timer.setSingleShot(True)
+        self.write_timer.setInterval(constants.SETTINGS_WRITE_DELAY)
+        self.write_timer.timeout.connect(self.writeSettings)
+
+        self.update_checker = None
+        self.update_timer = QtCore.QTimer()
+        self.update_timer.setInterval(constants.CHECK_RATE)
+        self.update_timer.timeout.connect(self.checkSoftwareUpdate)
+
         self.results_files = None
         self.params_buffer = ""
         self.init_time = 0
         self.init_date = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
 
         self.data_ring = None
+        self.acquisition_worker = None
+        self.settings_cache = None
+        self.settings_queue = None
+        self.setting_widgets = {} # widget of each queued setting, shows if its value was rejected
+        self.device_plots = [] # one per device added to the session, each holds its DeviceSession
         self.combinations = []
         self.combination_indexes = []
+        self.column_indexes = [] # position of each active combination in the stored columns
         self.save_as_button.clicked.connect(self.chooseFile)
         self.save_as_lineEdit.returnPressed.connect(self.setSaveAs)
 
@@ -200,11 +216,14 @@ class MainWindow(QMainWindow):
 
         delaySweep = QAction('Delay time', self)
         sleepSweep = QAction('Sleep time', self)
+        gridSweep = QAction('Delay time grid', self)
 
         self.menuBuildInSweep.addAction(delaySweep)
         self.menuBuildInSweep.addAction(sleepSweep)
+        self.menuBuildInSweep.addAction(gridSweep)
         delaySweep.triggered.connect(self.delaySweep)
         sleepSweep.triggered.connect(self.sleepSweep)
+        gridSweep.triggered.connect(self.gridSweep)
 
         self.menuBuildIn.addMenu(self.menuBuildInSweep)
 
@@ -214,10 +233,17 @@ class MainWindow(QMainWindow):
 
         self.actionAbout = QAction('About', self)
         self.actionSave_as = QAction('Save as', self)
+        self.actionExport = QAction('Export binary data', self)
+        self.actionAdd_device = QAction('Add device', self)
+        self.actionRemove_devices = QAction('Remove added devices', self)
         self.actionDefault_settings = QAction('Default settings', self)
         self.actionExit = QAction('Exit', self)
 
         self.menuFile.addAction(self.actionSave_as)
+        self.menuFile.addAction(self.actionExport)
+        self.menuFile.addSeparator()
+        self.menuFile.addAction(self.actionAdd_device)
+        self.menuFile.addAction(self.actionRemove_devices)
         self.menuFile.addSeparator()
         self.menuFile.addAction(self.actionExit)
         self.menuHelp.addAction(self.actionAbout)
@@ -231,10 +257,14 @@ class MainWindow(QMainWindow):
         self.menuView.addAction("Tiled")
         self.menuView.addAction("Cascade")
         self.menuView.addSeparator()
+        self.history_action = QAction("Plot session history", self.menuView, checkable=True)
+        self.menuView.addAction(self.history_action)
+        self.menuView.addSeparator()
         self.theme_action = self.menuView.addAction("Dark theme")
 
         for action in self.menuView.actions():
             if action.isCheckable(): action.setChecked(True)
+        self.history_action.setChecked(False)
 
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuProperties.menuAction())
@@ -246,6 +276,9 @@ class MainWindow(QMainWindow):
 
         self.actionSave_as.triggered.connect(self.chooseFile)
         self.actionSave_as.setShortcut("Ctrl+S")
+        self.actionExport.triggered.connect(self.exportBinary)
+        self.actionAdd_device.triggered.connect(self.addDevice)
+        self.actionRemove_devices.triggered.connect(self.removeDevices)
         self.actionDefault_settings.triggered.connect(self.settingsDialogCaller)
 
         self.actionAbout.triggered.connect(self.aboutWindowCaller)
@@ -259,6 +292,7 @@ class MainWindow(QMainWindow):
 
         self.delaySweepDialog = builtin.DelayDialog(self)
         self.sleepSweepDialog = builtin.SleepDialog(self)
+        self.gridSweepDialog = builtin.GridDialog(self)
 
         self.mdi.tileSubWindows()
         self.mdi.cascadeSubWindows()
@@ -275,17 +309,61 @@ class MainWindow(QMainWindow):
         self.initPlots()
         self.current_labels.createLabels(self.active_channels)
         self.combination_indexes = [i for (i, com) in enumerate(self.combinations) if com in self.active_channels]
+        if self.acquisition_worker != None:
+            self.acquisition_worker.setActiveChannels(self.active_channels)
+        self.updateColumns()
 
         "Clear table"
         self.historical_layout.removeWidget(self.historical_table)
         self.historical_table.deleteLater()
 
         "Create new table"
-        self.historical_table = Table(self.active_channels, self.combination_indexes)
+        self.historical_table = Table(self.active_channels, self.column_indexes)
         self.historical_layout.addWidget(self.historical_table)
 
         self.updateWidgets()
 
+    def addDevice(self):
+        """
+        Connects one more device. It gets its own worker, buffer, files (named
+        after the data file and the device) and plot, and is acquired together
+        with the main device, on the same clock.
+        """
+        if self.results_files == None:
+            QtWidgets.QMessageBox.warning(self, 'Error', "Please choose an output file.", QtWidgets.QMessageBox.Ok)
+            return
+        self.connect_dialog = ConnectDialog()
+        self.connect_dialog.refresh()
+        self.connect_dialog.exec_()
+        port = self.connect_dialog.comboBox.currentText()
+        if port == "": return
+        if (port == self.port_name) or (port in [plot.session.port for plot in self.device_plots]):
+            QtWidgets.QMessageBox.warning(self, 'Error', "%s is already connected." % port, QtWidgets.QMessageBox.Ok)
+            return
+        try:
+            try:
+                abacus.open(port)
+            except abacus.AbacusError:
+                pass
+            rows, save_interval = self.getBufferSettings()[:2] # device plots do not draw the history
+            prefix = os.path.splitext(self.results_files.data_file.name)[0]
+            session = DeviceSession(port, "%s_%s" % (prefix, deviceSuffix(port)), self.results_files.data_extention,
+                                    self.init_date, rows, save_interval)
+            session.writeParams("Connected to device in port, %s" % port)
+            session.writeParams("Data columns, %s" % session.data_ring.header)
+            if self.streaming:
+                session.configure(self.sampling_widget.getValue(), self.coincidence_spinBox.value())
+                session.start(self.init_time)
+        except (abacus.BaseError, SerialException) as e:
+            self.errorWindow(Exception("%s, %s" % (port, e)))
+            return
+        plot = DevicePlot(self, session)
+        self.device_plots.append(plot)
+        self.mdi.addSubWindow(plot)
+        plot.show()
+        self.writeParams("Added device in port, %s" % port)
+        self.statusBar.showMessage('Files: %s, %s.' % session.results_files.getNames())
+
     def centerOnScreen(self):
         resolution = QtGui.QDesktopWidget().screenGeometry()
         x_0 = self.pos().x()
@@ -314,9 +392,15 @@ class MainWindow(QMainWindow):
             raise ExtentionError()
 
     def checkParams(self):
+        """
+        Updates the widgets with the device settings. They are only read after
+        a write or every poll interval, and never while acquiring or while
+        writes are queued, so the serial port is left to the counters.
+        """
         if self.port_name != None:
+            if self.streaming or len(self.settings_queue) or not self.settings_cache.isDue(): return
             try:
-                settings = abacus.getAllSettings(self.port_name)
+                settings = self.settings_cache.read()
                 samp = int(settings.getSetting("sampling"))
                 coin = settings.getSetting("coincidence_window")
                 if self.number_channels == 4:
@@ -347,6 +431,21 @@ class MainWindow(QMainWindow):
             except SerialException as e:
                 self.errorWindow(e)
 
+    def checkSoftwareUpdate(self):
+        "Offers the version found by the update checker once it is done"
+        if self.update_checker == None or not self.update_checker.done.is_set(): return
+        self.update_timer.stop()
+        version = self.update_checker.version
+        self.update_checker = None
+        if version != None:
+            msg = QtWidgets.QMessageBox(self)
+            msg.setIcon(QtWidgets.QMessageBox.Information)
+            msg.setText("There is a new version avaible (%s).\nDo you want to download it?" % version)
+            msg.setWindowTitle("Update avaible")
+            msg.setStandardButtons(QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+            if msg.exec_() == QtWidgets.QMessageBox.Yes:
+                webbrowser.open(url.TARGET_URL)
+
     def chooseFile(self):
         """
         user interaction with saving file
@@ -372,19 +471,30 @@ class MainWindow(QMainWindow):
             self.setSaveAs()
 
     def clearPlot(self):
+        for plot in self.device_plots:
+            plot.session.data_ring.save()
+            plot.session.data_ring.clear()
+            plot.clear()
         if self.data_ring != None:
             self.data_ring.save()
             self.data_ring.clear()
-            for plot in self.plot_lines:
+            self.plotted_rows = 0
+            self.plotted_history = 0
+            for plot in self.plot_lines + self.history_lines:
                 plot.setData([], [])
 
     def cleanPort(self):
         if self.streaming:
             self.startAcquisition()
+        self.removeDevices()
 
         if self.port_name != None:
+            self.writeSettings()
             abacus.close(self.port_name)
             self.port_name = None
+            self.settings_cache = None
+            self.settings_queue = None
+            self.data_ring.close()
             self.data_ring = None
             self.setNumberChannels(0)
             self.subSettings(new=False)
@@ -396,13 +506,20 @@ class MainWindow(QMainWindow):
                                                quit_msg, QtWidgets.QMessageBox.Yes, QtWidgets.QMessageBox.No)
         if reply == QtWidgets.QMessageBox.Yes:
             try:
-                if self.data_ring != None:
+                self.writeSettings()
+                if self.acquisition_worker != None:
+                    self.stopClocks()
+                elif self.data_ring != None:
                     self.data_ring.save()
+                if self.data_ring != None:
+                    self.data_ring.close()
+                self.removeDevices()
             except Exception as e:
                 if abacus.constants.DEBUG: print(e)
             if self.results_files != None:
                 if self.results_files.data_file.isEmpty():
                     self.results_files.params_file.delete()
+                self.results_files.close()
             try:
                 self.settings_dialog.constantsWriter(update_parent=False)
             except Exception as e:
@@ -423,21 +540,13 @@ class MainWindow(QMainWindow):
                 step = 10  # 10ns
         self.coincidence_spinBox.setSingleStep(step)
         if self.port_name != None:
-            try:
-                abacus.setSetting(self.port_name, 'coincidence_window', val)
-                self.writeParams("Coincidence Window (ns), %s" % val)
-                self.coincidence_spinBox.setKeyboardTracking(True)
-                self.coincidence_spinBox.setStyleSheet("")
-            except abacus.InvalidValueError:
-                self.coincidence_spinBox.setKeyboardTracking(False)
-                self.coincidence_spinBox.setStyleSheet("color: rgb(255,0,0); selection-background-color: rgb(255,0,0)")
-            except serial.serialutil.SerialException:
-                self.errorWindow(e)
+            self.queueSetting('coincidence_window', val, self.coincidence_spinBox)
         elif abacus.constants.DEBUG:
             print("Coincidence Window Value: %d" % val)
         try:
             self.sleepSweepDialog.setCoincidence(val)
             self.delaySweepDialog.setCoincidence(val)
+            self.gridSweepDialog.setCoincidence(val)
         except AttributeError:
             pass
 
@@ -471,12 +580,17 @@ class MainWindow(QMainWindow):
 
                 self.subSettings(new=False)
 
-                self.data_ring = RingBuffer(constants.BUFFER_ROWS, len(self.combinations) + 2, self.combinations)
+                rows, save_interval, history = self.getBufferSettings()
+                self.data_ring = RingBuffer(rows, self.storedColumns(), save_interval=save_interval, history=history)
                 if self.results_files != None:
                     self.data_ring.setFile(self.results_files.data_file)
+                self.activeChannelsChanged(self.active_channels)
 
+                self.settings_cache = SettingsCache(port, self.getPollInterval())
+                self.settings_queue = SettingsQueue(port)
                 self.port_name = port  # not before
                 self.writeParams("Connected to device in port, %s" % self.port_name)
+                self.writeParams("Data columns, %s" % self.data_ring.header)
                 self.updateConstants()
                 self.check_timer.start()
 
@@ -486,17 +600,7 @@ class MainWindow(QMainWindow):
 
     def delayMethod(self, widget, letter, val):
         if self.port_name != None:
-            try:
-                abacus.setSetting(self.port_name, 'delay_%s' % letter, val)
-                self.writeParams("Delay %s (ns), %s" % (letter, val))
-                widget.setKeyboardTracking(True)
-                widget.setStyleSheet("")
-            except abacus.InvalidValueError:
-                widget.setKeyboardTracking(False)
-                widget.setStyleSheet("color: rgb(255,0,0); selection-background-color: rgb(255,0,0)")
-
-            except SerialException as e:
-                self.errorWindow(e)
+            self.queueSetting('delay_%s' % letter, val, widget)
         elif abacus.constants.DEBUG:
             print("Delay %s Value: %d" % (letter, val))
 
@@ -528,9 +632,57 @@ class MainWindow(QMainWindow):
         msg.setStandardButtons(QtWidgets.QMessageBox.Ok)
         msg.exec_()
 
+    def exportBinary(self):
+        """
+        converts a binary data file to the plain text layout
+        """
+        try:
+            path = constants.directory_lineEdit
+        except AttributeError:
+            path = os.path.expanduser("~")
+        filters = ";;".join([constants.SUPPORTED_EXTENSIONS[extension] for extension in constants.BINARY_EXTENSIONS])
+        name, ext = QtWidgets.QFileDialog.getOpenFileName(self, 'Export binary data', path, filters, "",
+                                                          QtWidgets.QFileDialog.DontUseNativeDialog)
+        if name != "":
+            if (self.results_files != None) and (name == self.results_files.data_file.name) and (self.data_ring != None):
+                self.data_ring.save()
+                self.data_ring.join()
+                self.results_files.data_file.flush()
+            try:
+                text_name = exportText(name)
+                self.statusBar.showMessage('Exported: %s.' % common.unicodePath(text_name))
+            except Exception as e:
+                self.errorWindow(e)
+
+    def getBufferSettings(self):
+        try:
+            rows = constants.buffer_rows_spinBox
+            save_interval = constants.save_interval_spinBox
+            history = constants.history_checkBox
+        except AttributeError:
+            rows = constants.BUFFER_ROWS
+            save_interval = constants.SAVE_INTERVAL
+            history = constants.KEEP_HISTORY
+        return rows, save_interval, history
+
+    def getColumnIndexes(self):
+        if self.data_ring == None: return []
+        columns = self.data_ring.combinations
+        return [columns.index(com) for com in self.active_channels if com in columns]
+
     def getLetter(self, i):
         return chr(i + ord('A'))
 
+    def getPollInterval(self):
+        try:
+            return constants.poll_interval_spinBox
+        except AttributeError:
+            return constants.SETTINGS_POLL_INTERVAL
+
+    def gridSweep(self):
+        self.gridSweepDialog.updateConstants()
+        self.gridSweepDialog.show()
+
     def handleViews(self, q):
         text = q.text()
         if "Show" in text:
@@ -552,6 +704,10 @@ class MainWindow(QMainWindow):
         elif text == "Tiled":
             self.mdi.tileSubWindows()
 
+        elif q is self.history_action:
+            self.plotted_rows = -1
+            self.plotted_history = -1
+
         elif 'theme' in text:
             if 'Dark theme' == text:
                 self.setDarkTheme()
@@ -574,6 +730,30 @@ class MainWindow(QMainWindow):
                                          symbolPen=color, symbolBrush=color,
                                          symbolSize=symbolSize, name=letter)
             self.plot_lines.append(plot)
+            self.history_lines.append(self.counts_plot.plot(pen=color))
+        self.plotted_rows = -1
+        self.plotted_history = -1
+
+    def queueSetting(self, setting, value, widget = None):
+        "Queues a setting, it is written once it stops changing for SETTINGS_WRITE_DELAY ms"
+        self.settings_queue.put(setting, value)
+        self.setting_widgets[setting] = widget
+        self.write_timer.start()
+
+    def removeDevices(self):
+        "Stops and disconnects every added device"
+        for plot in self.device_plots:
+            session = plot.session
+            try:
+                session.close()
+            except (abacus.BaseError, SerialException) as e:
+                if abacus.constants.DEBUG: print(e)
+            if session.results_files.data_file.isEmpty():
+                session.results_files.params_file.delete()
+            self.mdi.removeSubWindow(plot)
+            plot.deleteLater()
+            self.writeParams("Removed device in port, %s" % session.port)
+        self.device_plots = []
 
     def removePlots(self):
         if self.legend != None:
@@ -581,7 +761,10 @@ class MainWindow(QMainWindow):
                 self.legend.scene().removeItem(self.legend)
         for line in self.plot_lines:
             line.clear()
+        for line in self.history_lines:
+            self.counts_plot.removeItem(line)
         self.plot_lines = []
+        self.history_lines = []
         self.legend = None
 
     def samplingMethod(self, value, force_write=False):
@@ -589,35 +772,26 @@ class MainWindow(QMainWindow):
             if force_write: self.sampling_widget.setValue(value)
             value = self.sampling_widget.getValue()
             if value > 0 and self.port_name != None:
-                try:
-                    abacus.setSetting(self.port_name, 'sampling', value)
-                    if value > constants.DATA_REFRESH_RATE:
-                        self.refresh_timer.setInterval(value)
-                    else:
-                        self.refresh_timer.setInterval(constants.DATA_REFRESH_RATE)
-                    self.data_timer.setInterval(value)
-                    # self.sampling_widget.valid()
-                    self.writeParams("Sampling time (ms), %s" % value)
-                # except abacus.InvalidValueError as e:
-                #     self.sampling_widget.invalid()
-                except SerialException as e:
-                    self.errorWindow(e)
+                self.queueSetting('sampling', value)
+                if value > constants.DATA_REFRESH_RATE:
+                    self.refresh_timer.setInterval(value)
+                else:
+                    self.refresh_timer.setInterval(constants.DATA_REFRESH_RATE)
             elif abacus.constants.DEBUG:
                 print("Sampling Value, %d" % value)
         try:
             self.sleepSweepDialog.setSampling(value)
             self.delaySweepDialog.setSampling(value)
+            self.gridSweepDialog.setSampling(value)
         except AttributeError:
             pass
 
     def sendMultipleCoincidences(self, coincidences):
+        "Written at once, the acquisition worker reads the custom counters as soon as they change"
         if self.port_name != None:
-            try:
-                for (i, letters) in enumerate(coincidences):
-                    abacus.setSetting(self.port_name, 'config_custom_c%d' % (i + 1), letters)
-            except SerialException as e:
-                # except Exception as e:
-                self.errorWindow(e)
+            for (i, letters) in enumerate(coincidences):
+                self.queueSetting('config_custom_c%d' % (i + 1), letters)
+            self.writeSettings()
 
     def sendSettings(self):
         self.samplingMethod(self.sampling_widget.getValue())
@@ -629,6 +803,7 @@ class MainWindow(QMainWindow):
             sleep_widget = self.sleep_widgets[i]
             self.delayMethod(delay_widget, letter, delay_widget.value())
             self.sleepMethod(sleep_widget, letter, sleep_widget.value())
+        self.writeSettings()
 
     def setNumberChannels(self, n):
         self.number_channels = n
@@ -636,6 +811,7 @@ class MainWindow(QMainWindow):
         self.sampling_widget.changeNumberChannels(n)
         self.delaySweepDialog.setNumberChannels(n)
         self.sleepSweepDialog.setNumberChannels(n)
+        self.gridSweepDialog.setNumberChannels(n)
         self.tabs_widget.signal()
 
     def setDarkTheme(self):
@@ -646,6 +822,9 @@ class MainWindow(QMainWindow):
         self.theme_action.setText('Light theme')
         self.delaySweepDialog.setDarkTheme()
         self.sleepSweepDialog.setDarkTheme()
+        self.gridSweepDialog.setDarkTheme()
+        for plot in self.device_plots:
+            plot.setDarkTheme()
 
         self.current_labels.clearSizes()
         self.current_labels.resizeEvent(None)
@@ -663,6 +842,9 @@ class MainWindow(QMainWindow):
 
         self.delaySweepDialog.setLightTheme()
         self.sleepSweepDialog.setLightTheme()
+        self.gridSweepDialog.setLightTheme()
+        for plot in self.device_plots:
+            plot.setLightTheme()
 
         self.current_labels.clearSizes()
         self.current_labels.resizeEvent(None)
@@ -678,6 +860,8 @@ class MainWindow(QMainWindow):
                         self.results_files.params_file.header += self.params_buffer
                         self.params_buffer = ""
                     else:
+                        if self.data_ring != None:
+                            self.data_ring.join()
                         self.results_files.changeName(name, ext)
                     names = self.results_files.getNames()
                     if self.data_ring != None:
@@ -716,16 +900,7 @@ class MainWindow(QMainWindow):
 
     def sleepMethod(self, widget, letter, val):
         if self.port_name != None:
-            try:
-                abacus.setSetting(self.port_name, 'sleep_%s' % letter, val)
-                self.writeParams("Sleep %s (ns), %s" % (letter, val))
-                widget.setKeyboardTracking(True)
-                widget.setStyleSheet("")
-            except abacus.InvalidValueError:
-                widget.setKeyboardTracking(False)
-                widget.setStyleSheet("color: rgb(255,0,0); selection-background-color: rgb(255,0,0)")
-            except SerialException as e:
-                self.errorWindow(e)
+            self.queueSetting('sleep_%s' % letter, val, widget)
         elif abacus.constants.DEBUG:
             print("Sleep %s Value: %d" % (letter, val))
 
@@ -750,24 +925,60 @@ class MainWindow(QMainWindow):
                 self.results_files.writeParams("Acquisition started")
                 self.sendSettings()
                 self.unlockSettings(False)
+                if self.init_time == 0:
+                    self.init_time = time()
                 self.startClocks()
-
-            if self.init_time == 0:
-                self.init_time = time()
         else:
             QtWidgets.QMessageBox.warning(self, 'Error', "Please choose an output file.", QtWidgets.QMessageBox.Ok)
 
     def startClocks(self):
+        last_row = self.data_ring.lastRow()
+        if last_row is not None:
+            last_id = last_row[1]
+        else:
+            last_id = 0
+        self.acquisition_worker = AcquisitionWorker(self.port_name, self.combinations, self.number_channels,
+                                                    self.init_time, last_id, self.data_ring.combinations)
+        self.acquisition_worker.setActiveChannels(self.active_channels)
+        self.acquisition_worker.start()
+        for plot in self.device_plots:
+            try:
+                plot.session.configure(self.sampling_widget.getValue(), self.coincidence_spinBox.value())
+                plot.session.start(self.init_time)
+            except (abacus.BaseError, SerialException) as e:
+                self.errorWindow(Exception("%s, %s" % (plot.session.port, e)))
         self.refresh_timer.start()
         self.data_timer.start()
 
     def stopClocks(self):
         self.refresh_timer.stop()
         self.data_timer.stop()
+        if self.acquisition_worker != None:
+            self.acquisition_worker.stop()
+            self.updateData()
+            self.acquisition_worker = None
+        for plot in self.device_plots:
+            plot.session.stop()
+        self.data_ring.save()
+        self.data_ring.join()
+        error = self.data_ring.writer.getError()
+        if error != None:
+            self.errorWindow(error)
+        elif self.results_files != None:
+            try:
+                self.results_files.flush()
+            except FileNotFoundError as e:
+                self.errorWindow(e)
+
+    def storedColumns(self):
+        "Combinations kept in the buffer and data file"
         try:
-            self.data_ring.save()
-        except FileNotFoundError as e:
-            self.errorWindow(e)
+            compact = constants.compact_checkBox
+        except AttributeError:
+            compact = constants.COMPACT_COLUMNS
+        if compact:
+            return [com for com in self.combinations if com in self.active_channels]
+        return self.combinations
 
     def subCurrent(self):
         widget = QWidget()
@@ -1000,83 +1211,142 @@ class MainWindow(QMainWindow):
             else:
                 self.setDarkTheme()
 
-            if self.data_ring != None: self.data_ring.updateDelimiter(constants.DELIMITER)
+            if self.settings_cache != None:
+                self.settings_cache.interval = self.getPollInterval()
+
+            if self.data_ring != None:
+                self.data_ring.updateDelimiter(constants.DELIMITER)
+                rows, self.data_ring.save_interval, history = self.getBufferSettings()
+                if history != (self.data_ring.history != None):
+                    self.data_ring.setHistory(history)
+                    self.plotted_history = -1
+                if rows != self.data_ring.size:
+                    self.data_ring.resize(rows)
+                    self.plotted_rows = -1
+                if self.storedColumns() != self.data_ring.combinations:
+                    self.activeChannelsChanged(self.active_channels)
 
         except AttributeError as e:
             if abacus.constants.DEBUG: print(e)
 
-    def updateCurrents(self, data):
-        for (pos, index) in enumerate(self.combination_indexes):
-            self.current_labels.changeValue(pos, data[-1, index + 2])
+    def updateColumns(self):
+        """
+        Starts a new buffer when the stored combinations change. Rows with the
+        old columns are saved first, the data file continues with a repeated
+        header (or a new file for .npy) and the settings file gets the new
+        column map.
+        """
+        if self.data_ring != None:
+            columns = self.storedColumns()
+            if columns != self.data_ring.combinations:
+                old = self.data_ring
+                if self.acquisition_worker != None:
+                    rows = self.acquisition_worker.setColumns(columns)
+                    if len(rows):
+                        old.extend(np.array(rows, dtype=old.dtype))
+                old.save()
+                old.join()
+                error = old.writer.getError()
+                old.close()
+                rows, save_interval, history = self.getBufferSettings()
+                self.data_ring = RingBuffer(old.size, columns, save_interval=save_interval, history=history)
+                if self.results_files != None:
+                    name = self.results_files.data_file.name
+                    self.results_files.data_file.changeColumns(self.data_ring.header)
+                    self.data_ring.file = self.results_files.data_file
+                    if self.results_files.data_file.name != name:
+                        self.writeParams("Data file, %s" % self.results_files.data_file.name)
+                self.writeParams("Data columns, %s" % self.data_ring.header)
+                self.plotted_rows = -1
+                self.plotted_history = -1
+                if error != None:
+                    self.errorWindow(error)
+        self.column_indexes = self.getColumnIndexes()
+
+    def updateCurrents(self, row):
+        for (pos, index) in enumerate(self.column_indexes):
+            self.current_labels.changeValue(pos, row[index + 2])
 
     def updateData(self):
-        def get(counters, time_, id):
-            last = 3
-            if self.number_channels == 4:
-                last = 10
-            elif self.number_channels == 8:
-                last = 36
-            values = counters.getValues(self.combinations[:last])
-            "could be better"
-            if self.number_channels > 2:
-                i = 1
-                for letters in self.combinations[last:]:
-                    if letters in self.active_channels:
-                        val = counters.getValue("custom_c%d" % i)
-                        i += 1
-                    else:
-                        val = 0
-                    values.append(val)
-
-            values = np.array([time_, id] + values)
-            values = values.reshape((1, values.shape[0]))
-            self.data_ring.extend(values)
-
-        try:
-            for i in range(constants.NUMBER_OF_TRIES):
-                try:
-                    data = self.data_ring[:]
-                    time_ = time() - self.init_time
-                    if len(data):
-                        last_id = data[-1, 1]
-                    else:
-                        last_id = 0
-                    counters, id = abacus.getAllCounters(self.port_name)
-
-                    if (id > 0) and (last_id != id):
-                        get(counters, time_, id)
-                        break
-                    else:
-                        time_left = abacus.getTimeLeft(self.port_name) / 1000  # seconds
-                        sleep(time_left)
-                except abacus.BaseError as e:
-                    if i == (constants.NUMBER_OF_TRIES - 1): raise (e)
-
-        except SerialException as e:
-            self.errorWindow(e)
-        except abacus.BaseError as e:
-            self.errorWindow(e)
-        except FileNotFoundError as e:
-            self.errorWindow(e)
-
-    def updatePlots(self, data):
-        time_ = data[:, 0]
-        for (i, j) in enumerate(self.combination_indexes):
-            self.plot_lines[i].setData(time_, data[:, j + 2])
+        """
+        Moves the rows polled by the acquisition worker into the ring buffer.
+        No device I/O happens here.
+        """
+        for plot in self.device_plots:
+            plot.session.update()
+            error = plot.session.getError()
+            if error != None:
+                self.errorWindow(Exception("%s, %s" % (plot.session.port, error)))
+        worker = self.acquisition_worker
+        if worker == None: return
+        rows = worker.getRows(self.data_ring.dtype)
+        if rows is not None:
+            self.data_ring.extend(rows)
+        error = self.data_ring.writer.getError()
+        if error != None:
+            self.errorWindow(error)
+        error = worker.error
+        if error != None:
+            worker.error = None
+            self.errorWindow(error)
+
+    def updatePlots(self):
+        """
+        Redraws the lines only when new rows arrived. The plot clips to the
+        view and keeps the peaks of each pixel column, so the cost of a redraw
+        does not grow with the history.
+        """
+        total_rows = self.data_ring.total_rows
+        if total_rows == self.plotted_rows: return
+        self.plotted_rows = total_rows
+
+        self.updateHistory()
+        data = self.data_ring[:]
+        names = self.data_ring.header_list
+        time_ = data[names[0]]
+        symbol = None
+        if len(time_) <= constants.PLOT_SYMBOL_LIMIT: symbol = 'o'
+        for (i, j) in enumerate(self.column_indexes):
+            line = self.plot_lines[i]
+            if line.opts['symbol'] != symbol:
+                line.setSymbol(symbol)
+            line.setData(time_, data[names[j + 2]])
+
+    def updateHistory(self):
+        """
+        Draws the rows spilled to disk, which are read memory-mapped.
+        """
+        data = None
+        if self.history_action.isChecked():
+            data = self.data_ring.getHistory()
+        if data is None:
+            rows = 0
+        else:
+            rows = data.shape[0]
+        if rows == self.plotted_history: return
+        self.plotted_history = rows
+
+        names = self.data_ring.header_list
+        for (i, j) in enumerate(self.column_indexes):
+            if data is None:
+                self.history_lines[i].setData([], [])
+            else:
+                self.history_lines[i].setData(data[names[0]], data[names[j + 2]])
 
-    def updateTable(self, data):
-        self.historical_table.insertData(data)
+    def updateTable(self):
+        self.historical_table.insertData(self.data_ring)
 
     def updateWidgets(self):
+        for plot in self.device_plots:
+            plot.updatePlot()
         if self.data_ring != None:
-            data = self.data_ring[:]
-            if data.shape[0]:
-                self.updatePlots(data)
-                self.updateTable(data)
-                self.updateCurrents(data)
+            if len(self.data_ring):
+                self.updatePlots()
+                self.updateTable()
+                self.updateCurrents(self.data_ring.lastRow())
 
     def writeParams(self, message):
-        exceptions = ["Connected", "Acquisition"]
+        exceptions = ["Connected", "Acquisition", "Data"]
         is_exception = sum([1 if exception in message else 0 for exception in exceptions])
         if is_exception | self.streaming:
             if self.results_files != None:
@@ -1089,8 +1359,38 @@ class MainWindow(QMainWindow):
         elif abacus.constants.DEBUG:
             print("writeParams ignored: %s" % message)
 
+    def writeSettings(self):
+        """
+        Writes the queued settings holding the port once. Only the last value
+        of each setting is written and logged, widgets with a rejected value
+        turn red until a valid one is written.
+        """
+        self.write_timer.stop()
+        if (self.settings_queue == None) or (len(self.settings_queue) == 0): return
+        try:
+            written, invalid = self.settings_queue.flush()
+        except SerialException as e:
+            self.errorWindow(e)
+            return
+        if len(written):
+            self.settings_cache.invalidate()
+        for (setting, value) in written.items():
+            widget = self.setting_widgets.pop(setting, None)
+            if widget != None:
+                widget.setKeyboardTracking(True)
+                widget.setStyleSheet("")
+            label = settingLabel(setting)
+            if label != None:
+                self.writeParams("%s, %s" % (label, value))
+        for setting in invalid:
+            widget = self.setting_widgets.pop(setting, None)
+            if widget != None:
+                widget.setKeyboardTracking(False)
+                widget.setStyleSheet("color: rgb(255,0,0); selection-background-color: rgb(255,0,0)")
+
 
-def softwareUpdate(splash):
+def softwareUpdate():
+    "Starts looking for a new version on the background, returns the checker or None if updates are not checked"
     try:
         check = constants.check_updates_checkBox
     except:
@@ -1098,21 +1398,13 @@ def softwareUpdate(splash):
             os.remove(constants.SETTINGS_PATH)
         check = True
     if check:
-        version = url.checkUpdate()
-        if version != None:
-            splash.close()
-            msg = QtWidgets.QMessageBox()
-            msg.setIcon(QtWidgets.QMessageBox.Information)
-            msg.setText("There is a new version avaible (%s).\nDo you want to download it?" % version)
-            msg.setWindowTitle("Update avaible")
-            msg.setStandardButtons(QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
-            if msg.exec_() == QtWidgets.QMessageBox.Yes:
-                webbrowser.open(url.TARGET_URL)
-                exit()
+        checker = url.UpdateChecker()
+        checker.start()
+        return checker
+    return None
 
 
 def run():
-    from time import sleep
     global app
 
     os.environ['PYQTGRAPH_QT_LIB'] = 'PyQt5'
@@ -1120,6 +1412,7 @@ def run():
     app = QtWidgets.QApplication(sys.argv)
     app.setStyle(QtWidgets.QStyleFactory.create('Fusion'))  # <- Choose the style
 
+    resources.load()
     splash_pix = QtGui.QPixmap(':/splash.png').scaledToWidth(600)
     splash = QtWidgets.QSplashScreen(splash_pix, QtCore.Qt.WindowStaysOnTopHint)
     splash.show()
@@ -1133,18 +1426,19 @@ def run():
         myappid = 'abacus.abacus.01'  # arbitrary string
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
-    sleep(1)
-
-    softwareUpdate(splash)
-    splash.close()
+    checker = softwareUpdate()
 
     main = MainWindow()
     main.setWindowIcon(constants.ICON)
+    splash.close()
 
     main.show2()
     main.resize(800, 600)
     main.mdi.tileSubWindows()
     main.centerOnScreen()
+    if checker != None:
+        main.update_checker = checker
+        main.update_timer.start()
     app.exec_()
 
 
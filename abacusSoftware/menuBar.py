@@ -1,6 +1,5 @@
-import abacusSoftware.__GUI_images__ as __GUI_images__
-
 import pyAbacus as pa
+import abacusSoftware.resources as resources
 from abacusSoftware.constants import __version__
 from PyQt5 import QtCore, QtGui, QtWidgets
 from abacusSoftware.__about__ import Ui_Dialog as Ui_Dialog_about
@@ -12,6 +11,7 @@ class AboutWindow(QtWidgets.QDialog, Ui_Dialog_about):
         self.setupUi(self)
         self.parent = parent
 
+        resources.load()
         image = QtGui.QPixmap(':/splash.png')
         image = image.scaled(220, 220, QtCore.Qt.KeepAspectRatio)
         self.image_label.setPixmap(image)
@@ -0,0 +1,23 @@
+"""
+Qt resources of the program: the splash and the icons, read as ':/name'.
+
+They are registered the first time a window needs them instead of when the
+package is imported, so the command line never loads them. A compiled
+images.rcc next to this module is preferred, Qt maps it from disk and its
+bytes are not copied into the interpreter; the resource module generated by
+pyrcc5 is imported otherwise. Both are built with `make resources`.
+"""
+import os
+from PyQt5 import QtCore
+
+RCC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images.rcc")
+
+LOADED = False
+
+def load():
+    "Registers the resources once, later calls do nothing"
+    global LOADED
+    if LOADED: return
+    if not (os.path.exists(RCC_PATH) and QtCore.QResource.registerResource(RCC_PATH)):
+        import abacusSoftware.__GUI_images__
+    LOADED = True
@@ -0,0 +1,119 @@
+import re
+
+import abacusSoftware.constants as constants
+from abacusSoftware.files import ResultsFiles, RingBuffer
+from abacusSoftware.acquisition import AcquisitionWorker, portLock, getCombinations
+import pyAbacus as abacus
+
+def nativeCombinations(combinations):
+    "Singles and pairs, the combinations every device counts without custom counters"
+    n = len([letters for letters in combinations if len(letters) == 1])
+    return combinations[:n * (n + 1) // 2]
+
+def deviceSuffix(port):
+    "Part of a file name that tells the files of a device apart"
+    return re.sub("[^0-9A-Za-z]+", "_", port).strip("_")
+
+class DeviceSession(object):
+    """
+    One device of a session: its acquisition worker, ring buffer and files.
+    The sessions of several devices are started with the same `init_time`,
+    so their rows share one clock. Each device is polled on its own thread
+    and serial reads release the GIL, so devices do not wait on each other.
+
+    `channels` are the stored combinations, the singles and pairs by default.
+    Multi-fold coincidences among them are set on the custom counters.
+    """
+    def __init__(self, port, prefix, extention, init_date, rows = constants.BUFFER_ROWS,
+                    save_interval = constants.SAVE_INTERVAL, history = False, channels = None):
+        self.port = port
+        self.number_channels = abacus.getChannelsFromName(port)
+        self.combinations = getCombinations(self.number_channels)
+        self.channels = channels
+        if channels == None:
+            self.channels = nativeCombinations(self.combinations)
+        unknown = [letters for letters in self.channels if letters not in self.combinations]
+        if len(unknown):
+            raise ValueError("%s are not combinations of a %d channel device." % (", ".join(unknown), self.number_channels))
+
+        self.results_files = ResultsFiles(prefix, extention, init_date)
+        self.data_ring = RingBuffer(rows, self.channels, save_interval = save_interval, history = history)
+        self.data_ring.setFile(self.results_files.data_file)
+        self.worker = None
+        self.error = None # error of a stopped worker
+
+    def checkFilesExists(self):
+        self.results_files.checkFilesExists()
+
+    def writeParams(self, text):
+        self.results_files.writeParams(text)
+
+    def configure(self, sampling = None, coincidence = None):
+        """
+        Sets the multi-fold coincidences of channels on the custom counters and
+        writes the given settings. Returns the sampling time and coincidence
+        window of the device.
+        """
+        multiple = [letters for letters in self.combinations[len(nativeCombinations(self.combinations)):] \
+                        if letters in self.channels]
+        with portLock(self.port):
+            for (i, letters) in enumerate(multiple):
+                abacus.setSetting(self.port, 'config_custom_c%d' % (i + 1), letters)
+            if sampling != None:
+                abacus.setSetting(self.port, 'sampling', sampling)
+            if coincidence != None:
+                abacus.setSetting(self.port, 'coincidence_window', coincidence)
+            sampling = abacus.getSetting(self.port, 'sampling')
+            coincidence = abacus.getSetting(self.port, 'coincidence_window')
+        self.writeParams("Sampling time (ms), %s" % sampling)
+        self.writeParams("Coincidence Window (ns), %s" % coincidence)
+        return sampling, coincidence
+
+    def start(self, init_time):
+        if self.worker != None: return
+        last_id = 0
+        last_row = self.data_ring.lastRow()
+        if last_row is not None:
+            last_id = last_row[1]
+        self.worker = AcquisitionWorker(self.port, self.combinations, self.number_channels, init_time, last_id, self.channels)
+        self.worker.setActiveChannels(self.channels)
+        self.worker.start()
+        self.writeParams("Acquisition started")
+
+    def update(self):
+        "Moves the rows polled by the worker into the ring buffer, returns them or None if there are none"
+        if self.worker == None: return None
+        rows = self.worker.getRows(self.data_ring.dtype)
+        if rows is not None:
+            self.data_ring.extend(rows)
+        return rows
+
+    def getError(self):
+        "Pops an error of the worker or of the file writer, None if there is none"
+        error = self.data_ring.writer.getError()
+        if (error == None) and (self.worker != None):
+            error = self.worker.error
+            self.worker.error = None
+        if error == None:
+            error = self.error
+            self.error = None
+        return error
+
+    def stop(self):
+        "Stops the worker and writes every row, the device stays open"
+        if self.worker != None:
+            self.worker.stop()
+            self.update()
+            if self.worker.error != None:
+                self.error = self.worker.error
+            self.worker = None
+            self.writeParams("Acquisition stopped")
+        self.data_ring.save()
+        self.data_ring.join()
+        self.results_files.flush()
+
+    def close(self):
+        self.stop()
+        self.data_ring.close()
+        self.results_files.close()
+        abacus.close(self.port)
@@ -1,16 +1,15 @@
 import os
 import numpy as np
+import pyqtgraph as pg
 from itertools import combinations
 
 try:
     from PyQt5 import QtWidgets, QtGui, QtCore
-    from PyQt5.QtGui import QTableWidgetItem
     from PyQt5.QtWidgets import QSizePolicy, QTabWidget, QWidget, QCheckBox, \
                         QVBoxLayout, QFrame, QGroupBox, QLabel, QSizePolicy, \
                         QComboBox, QSpinBox, QFormLayout
 except ModuleNotFoundError:
     from PyQt4 import QtWidgets, QtGui, QtCore
-    from PyQt4.QtGui import QTableWidgetItem
     from PyQt4.QtWidgets import QSizePolicy
 
 from pyAbacus.constants import CURRENT_OS
@@ -194,46 +193,92 @@ class Tabs(QFrame):
             getattr(self, letters).setChecked(True)
             self.last_multiple_checked = letters
 
-class Table(QtWidgets.QTableWidget):
+class RingTableModel(QtCore.QAbstractTableModel):
+    """
+    Table model that reads straight from a RingBuffer, newest row first.
+    Cells are only formatted when the view asks for them, so the cost of an
+    update does not depend on how long the session has been running.
+    """
+    def __init__(self, headers, active_indexes, parent = None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.headers = headers
+        self.active_indexes = active_indexes
+        self.ring = None
+        self.rows = 0
+        self.last_data = 0 # ring total_rows when the model was last updated
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return self.rows
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role = QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal) and (role == QtCore.Qt.DisplayRole):
+            return self.headers[section]
+        return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
+
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.TextAlignmentRole:
+            return QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter
+        if (role != QtCore.Qt.DisplayRole) or (not index.isValid()):
+            return None
+        position = self.last_data - 1 - index.row() - (self.ring.total_rows - len(self.ring))
+        if (position < 0) or (position >= len(self.ring)):
+            return None
+        row = self.ring[position]
+        j = index.column()
+        if j == 0:
+            return "%.3f" % row[0]
+        elif j == 1:
+            return "%d" % row[1]
+        return "%d" % row[2 + self.active_indexes[j - 2]]
+
+    def updateData(self, ring):
+        total_rows = ring.total_rows
+        if (ring is not self.ring) or (total_rows < self.last_data) or (len(ring) < self.rows):
+            self.beginResetModel()
+            self.ring = ring
+            self.rows = len(ring)
+            self.last_data = total_rows
+            self.endResetModel()
+            return
+
+        new = total_rows - self.last_data
+        if new <= 0: return
+        grow = len(ring) - self.rows
+        if grow > 0:
+            self.beginInsertRows(QtCore.QModelIndex(), 0, grow - 1)
+            self.rows = len(ring)
+            self.last_data = total_rows
+            self.endInsertRows()
+        else:
+            self.last_data = total_rows
+        if (new > grow) and (self.rows > 0):
+            "the buffer is full, every row moved down"
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rows - 1, len(self.headers) - 1))
+
+class Table(QtWidgets.QTableView):
     def __init__(self, active_labels, active_indexes):
-        QtWidgets.QTableWidget.__init__(self)
-        cols = len(active_indexes) + 2
-        self.setColumnCount(cols)
+        QtWidgets.QTableView.__init__(self)
         self.horizontalHeader().setSortIndicatorShown(False)
         self.verticalHeader().setDefaultSectionSize(18)
         self.verticalHeader().setMinimumSectionSize(18)
         self.verticalHeader().setSortIndicatorShown(False)
 
-        self.last_data = 0
-        self.n_active = len(active_indexes)
         self.active_indexes = active_indexes
 
         self.headers = ['Time (s)', 'ID'] + active_labels
-        self.setHorizontalHeaderLabels(self.headers)
-        self.resizeRowsToContents()
-        self.resizeColumnsToContents()
+        self.table_model = RingTableModel(self.headers, active_indexes, self)
+        self.setModel(self.table_model)
 
         self.horizontalHeader().setResizeMode(QtWidgets.QHeaderView.Stretch)
         self.horizontalHeader().setStretchLastSection(True);
 
-    def insertData(self, data):
-        rows, cols = data.shape
-        data = data[self.last_data : ]
-        self.last_data = rows
-        rows = data.shape[0]
-
-        for i in range(rows):
-            self.insertRow(0)
-            for j in range(self.n_active + 2):
-                fmt = "%d"
-                if j < 2:
-                    if j == 0:
-                        fmt = "%.3f"
-                    value = fmt % data[i, j]
-                else:
-                    value = fmt % data[i, 2 + self.active_indexes[j - 2]]
-                self.setItem(0, j, QTableWidgetItem(value))
-                self.item(0, j).setTextAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignVCenter)
+    def insertData(self, ring):
+        self.table_model.updateData(ring)
 
 class AutoSizeLabel(QtWidgets.QLabel):
     """ From reclosedev at http://stackoverflow.com/questions/8796380/automatically-resizing-label-text-in-qt-strange-behaviour
@@ -516,6 +561,17 @@ class SettingsDialog(QtWidgets.QDialog):
         self.theme_label = QtWidgets.QLabel("Light theme:")
         self.theme_checkBox = QtWidgets.QCheckBox()
 
+        self.buffer_rows_label = QtWidgets.QLabel("Rows kept in memory:")
+        self.buffer_rows_spinBox = QtWidgets.QSpinBox()
+        self.save_interval_label = QtWidgets.QLabel("Save interval (s):")
+        self.save_interval_spinBox = QtWidgets.QSpinBox()
+        self.history_label = QtWidgets.QLabel("Keep plot history on disk:")
+        self.history_checkBox = QtWidgets.QCheckBox()
+        self.compact_label = QtWidgets.QLabel("Store enabled counts only:")
+        self.compact_checkBox = QtWidgets.QCheckBox()
+        self.poll_interval_label = QtWidgets.QLabel("Settings read interval (s):")
+        self.poll_interval_spinBox = QtWidgets.QSpinBox()
+
         self.file_tab_verticalLayout.addWidget(self.file_tab_frame2)
 
         widgets = [(self.theme_label, self.theme_checkBox),
@@ -526,6 +582,11 @@ class SettingsDialog(QtWidgets.QDialog):
                     (self.parameters_label, self.parameters_lineEdit),
                     (self.extension_label, self.extension_comboBox),
                     (self.delimiter_label, self.delimiter_comboBox),
+                    (self.buffer_rows_label, self.buffer_rows_spinBox),
+                    (self.save_interval_label, self.save_interval_spinBox),
+                    (self.history_label, self.history_checkBox),
+                    (self.compact_label, self.compact_checkBox),
+                    (self.poll_interval_label, self.poll_interval_spinBox),
                     ]
 
         self.fillFormLayout(self.file_tab_frame2_layout, widgets)
@@ -537,6 +598,20 @@ class SettingsDialog(QtWidgets.QDialog):
         self.check_updates_checkBox.setCheckState(2)
         self.autogenerate_checkBox.stateChanged.connect(self.actogenerateMethod)
         self.datetime_checkBox.setCheckState(2)
+        self.buffer_rows_spinBox.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.buffer_rows_spinBox.setRange(constants.BUFFER_ROWS_MINIMUM, constants.BUFFER_ROWS_MAXIMUM)
+        self.buffer_rows_spinBox.setSingleStep(constants.BUFFER_ROWS_MINIMUM)
+        self.buffer_rows_spinBox.setValue(constants.BUFFER_ROWS)
+        self.save_interval_spinBox.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.save_interval_spinBox.setRange(0, constants.SAVE_INTERVAL_MAXIMUM)
+        self.save_interval_spinBox.setSpecialValueText("When memory is full")
+        self.save_interval_spinBox.setValue(constants.SAVE_INTERVAL)
+        self.history_checkBox.setChecked(constants.KEEP_HISTORY)
+        self.compact_checkBox.setChecked(constants.COMPACT_COLUMNS)
+        self.poll_interval_spinBox.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.poll_interval_spinBox.setRange(0, constants.SETTINGS_POLL_INTERVAL_MAXIMUM)
+        self.poll_interval_spinBox.setSpecialValueText("Only after changes")
+        self.poll_interval_spinBox.setValue(constants.SETTINGS_POLL_INTERVAL)
         self.parameters_lineEdit.setText(constants.PARAMS_SUFFIX)
         self.file_prefix_lineEdit.setText(constants.FILE_PREFIX)
         # self.setDirectory()
@@ -545,6 +620,7 @@ class SettingsDialog(QtWidgets.QDialog):
         # else: self.direco
         self.delimiter_comboBox.insertItems(0, constants.DELIMITERS)
         self.extension_comboBox.insertItems(0, sorted(constants.SUPPORTED_EXTENSIONS.keys())[::-1])
+        self.extension_comboBox.setCurrentIndex(self.extension_comboBox.findText(constants.EXTENSION_DATA))
 
 
         """
@@ -712,6 +788,54 @@ class SubWindow(QtWidgets.QMdiSubWindow):
         for action in actions:
             if name in action.text(): action.setChecked(False)
 
+class DevicePlot(SubWindow):
+    """
+    Counts of a device added to the session, drawn like the main plot.
+    """
+    def __init__(self, parent, session):
+        super(DevicePlot, self).__init__(parent)
+        self.session = session
+        self.plot_win = pg.GraphicsWindow()
+        self.plot = self.plot_win.addPlot()
+        self.plot.setLabel('left', "Counts")
+        self.plot.setLabel('bottom', "Time", units='s')
+        self.plot.setDownsampling(auto=True, mode='peak')
+        self.plot.setClipToView(True)
+        self.plot.addLegend()
+        n = len(constants.COLORS)
+        self.plot_lines = []
+        for (i, letters) in enumerate(session.channels):
+            color = constants.COLORS[i % n]
+            self.plot_lines.append(self.plot.plot(pen=color, name=letters))
+        self.plotted_rows = -1
+        self.setWidget(self.plot_win)
+        self.setWindowTitle("Plots %s" % session.port)
+        if not constants.IS_LIGHT_THEME: self.setDarkTheme()
+
+    def setDarkTheme(self):
+        self.plot_win.setBackground((25, 35, 45))
+        self.plot.getAxis('bottom').setPen(foreground = 'w')
+        self.plot.getAxis('left').setPen(foreground = 'w')
+
+    def setLightTheme(self):
+        self.plot_win.setBackground(None)
+        self.plot.getAxis('bottom').setPen()
+        self.plot.getAxis('left').setPen()
+
+    def clear(self):
+        self.plotted_rows = -1
+        for line in self.plot_lines:
+            line.setData([], [])
+
+    def updatePlot(self):
+        data_ring = self.session.data_ring
+        if data_ring.total_rows == self.plotted_rows: return
+        self.plotted_rows = data_ring.total_rows
+        data = data_ring[:]
+        names = data_ring.header_list
+        for (i, line) in enumerate(self.plot_lines):
+            line.setData(data[names[0]], data[names[i + 2]])
+
 class ClickableLineEdit(QtGui.QLineEdit):
     clicked = QtCore.pyqtSignal()
     def __init__(self, parent = None):
@@ -0,0 +1,344 @@
+import os
+import numpy as np
+from time import time
+from functools import partial
+from threading import Thread, Event
+
+import abacusSoftware.constants as constants
+from abacusSoftware.files import File
+from abacusSoftware.acquisition import portLock
+import pyAbacus as abacus
+
+SLEEP = "Sleep time"
+COINCIDENCE_WINDOW = "Coincidence window"
+
+class Sweep(object):
+    """
+    Measures the device at a sequence of settings. `steps` holds one dict of
+    setting names and values per step, `channels` the counters read at each
+    step, and each step averages up to `n` samples of `sampling` ms. With a
+`target`, a step ends as soon as every channel adds up `target` counts, so
+the repeats go where counts are low and the Poisson error is high.
+
+    Only the settings that change between steps are written. The sample that
+    is running while they are written holds counts of both steps, so it is
+    dropped and the step starts on the next one; no extra sampling period is
+    slept. Writes are only read back when `verify` is set, pyAbacus raises on
+    values out of range before they are sent.
+    """
+    def __init__(self, port, steps, channels, n, sampling, target = 0, verify = constants.SWEEP_VERIFY):
+        self.port = port
+        self.steps = steps
+        self.channels = channels
+        self.n = n
+        self.target = target
+        self.sampling = sampling / 1000 # seconds
+        self.verify = verify
+        self.current = {} # settings last written to the device
+        self.last_id = 0 # ID of the last sample used
+        self.index = 0 # next step to measure
+        self.timing = [] # (configuration, total) time of every step, in seconds
+        self.repeats = [] # samples averaged on every step
+        self.stop_event = Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def isStopped(self):
+        return self.stop_event.is_set()
+
+    def wait(self, seconds):
+        self.stop_event.wait(max(seconds, constants.ACQUISITION_MIN_WAIT))
+
+    def write(self, step):
+        "Writes the settings of step that differ from the device, returns how many were written"
+        changed = [(setting, value) for (setting, value) in step.items() if self.current.get(setting) != value]
+        for (setting, value) in changed:
+            for j in range(constants.NUMBER_OF_TRIES):
+                try:
+                    with portLock(self.port):
+                        abacus.setSetting(self.port, setting, value)
+                        if (not self.verify) or (abacus.getSetting(self.port, setting) == value):
+                            break
+                except abacus.BaseError as e:
+                    if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
+                    self.wait(1e-2)
+            else:
+                raise abacus.BaseError("%s could not be set to %s." % (setting, value))
+            self.current[setting] = value
+        return len(changed)
+
+    def countersId(self):
+        for j in range(constants.NUMBER_OF_TRIES):
+            try:
+                with portLock(self.port):
+                    return abacus.getCountersID(self.port)
+            except abacus.BaseError as e:
+                if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
+
+    def read(self, first_id):
+        "Waits for a sample with an ID of at least first_id, returns its counters and ID"
+        for j in range(constants.NUMBER_OF_TRIES):
+            while not self.isStopped():
+                try:
+                    with portLock(self.port):
+                        counters, id = abacus.getFollowingCounters(self.port, self.channels)
+                        if id >= first_id:
+                            return counters, id
+                        time_left = abacus.getTimeLeft(self.port) / 1000 # seconds
+                except abacus.BaseError as e:
+                    if j == (constants.NUMBER_OF_TRIES - 1): raise(e)
+                    break
+                if id > 0:
+                    time_left += (first_id - id - 1) * self.sampling
+                self.wait(time_left)
+        return None, 0
+
+    def measure(self, step):
+        "Configures and measures one step, returns the average of each channel or None if stopped"
+        start = time()
+        first_id = self.last_id + 1
+        if self.write(step):
+            first_id = max(first_id, self.countersId() + 2)
+        configured = time()
+
+        values = np.zeros(len(self.channels))
+        repeats = 0
+        while repeats < max(self.n, 1):
+            counters, id = self.read(first_id)
+            if counters == None: return None
+            values += counters.getValues(self.channels)
+            repeats += 1
+            self.last_id = id
+            first_id = id + 1
+            if self.target and (values.min() >= self.target): break
+        self.timing.append((configured - start, time() - start))
+        self.repeats.append(repeats)
+        return values / repeats
+
+    def addSteps(self, steps):
+        "Appends steps to a running sweep, they are measured after the current ones"
+        self.steps += steps
+
+    def iterate(self):
+        "Yields the index and the averages of every step not measured yet, in order"
+        while self.index < len(self.steps):
+            values = self.measure(self.steps[self.index])
+            if values is None: return
+            self.index += 1
+            yield self.index - 1, values
+
+    def getStepTime(self):
+        "Mean time per step, None before the first step"
+        if len(self.timing) == 0: return None
+        return np.mean([total for (configuration, total) in self.timing])
+
+class SweepResults(object):
+    """
+    Points of a sweep, written by the sweep thread while the GUI reads them.
+    The arrays are preallocated and a point is stored before `count` grows,
+    so `get` returns a consistent prefix as views, without locks or copies.
+    Points of grid sweeps have one coordinate per dimension.
+    """
+    def __init__(self, size, columns, dimensions = 1):
+        shape = ()
+        if dimensions > 1: shape = (dimensions,)
+        self.x = np.zeros((max(size, 1),) + shape)
+        self.y = np.zeros((max(size, 1), columns))
+        self.count = 0
+
+    def append(self, x, values):
+        n = self.count
+        if n == len(self.x):
+            "full, only adaptive sweeps add points: the arrays are swapped for larger copies"
+            larger_x = np.zeros((2 * n,) + self.x.shape[1:])
+            larger_y = np.zeros((2 * n, self.y.shape[1]))
+            larger_x[:n] = self.x
+            larger_y[:n] = self.y
+            self.y = larger_y
+            self.x = larger_x
+        self.x[n] = x
+        self.y[n] = values
+        self.count = n + 1
+
+    def get(self):
+        n = self.count
+        return self.x[:n], self.y[:n]
+
+    def __len__(self):
+        return self.count
+
+def refineSteps(x, y, previous, step, low, high):
+    """
+    Next pass of a coarse to fine sweep: points every `step` within
+    `previous` of the maximum of each column of y, inside [low, high] and
+    not already in x.
+    """
+    x = np.asarray(x)
+    new = set()
+    for column in np.asarray(y).reshape((len(x), -1)).T:
+        center = x[np.argmax(column)]
+        new.update(np.arange(center - previous + step, center + previous, step))
+    measured = set(x)
+    return sorted([int(value) for value in new if (low <= value <= high) and (value not in measured)])
+
+def serpentine(*axes):
+    """
+    Every point of the grid spanned by axes, as tuples ordered so that only
+    one coordinate changes between consecutive points: the last axis runs
+    forward and backward in turns (boustrophedon order), and so on up.
+    """
+    if len(axes) == 0:
+        return [()]
+    inner = serpentine(*axes[1:])
+    points = []
+    for (i, value) in enumerate(axes[0]):
+        if i % 2: order = inner[::-1]
+        else: order = inner
+        points += [(value,) + point for point in order]
+    return points
+
+def delaySteps(channel1, others, delays):
+    "Settings of a delay sweep, negative delays are written to channel1 and positive ones to the others"
+    steps = []
+    for delay in delays:
+        if delay > 0:
+            delay1 = 0
+            delay2 = delay
+        else:
+            delay1 = abs(delay)
+            delay2 = 0
+        step = {"delay_%s" % channel1: int(delay1)}
+        for other in others:
+            step["delay_%s" % other] = int(delay2)
+        steps.append(step)
+    return steps
+
+def sleepSteps(channel, values):
+    return [{"sleep_%s" % channel: int(sleep)} for sleep in values]
+
+def gridSteps(channel1, channel2, setting, points):
+    "Settings of a grid sweep, points are (delay, value) with value a SLEEP of both channels or a COINCIDENCE_WINDOW"
+    steps = delaySteps(channel1, [channel2], [delay for (delay, value) in points])
+    for (step, (delay, value)) in zip(steps, points):
+        if setting == SLEEP:
+            step["sleep_%s" % channel1] = int(value)
+            step["sleep_%s" % channel2] = int(value)
+        else:
+            step["coincidence_window"] = int(value)
+    return steps
+
+def gridPoints(delays, values):
+    "(delay, value) points of a grid sweep, the values are the outer axis and change once per row"
+    return [(delay, value) for (value, delay) in serpentine(values, delays)]
+
+def delaySweep(channel1, others):
+    "Channels, file header and steps maker of a sweep of the delay of channel1 against others"
+    pairs = ["".join(sorted(channel1 + other)) for other in others]
+    if len(others) > 1:
+        header = constants.DELIMITER.join(["Delay time (ns)"] + ["Coincidences %s" % pair for pair in pairs])
+    else:
+        header = "Delay time (ns)" + constants.DELIMITER + "Coincidences"
+    return pairs, header, partial(delaySteps, channel1, others)
+
+def sleepSweep(channel):
+    header = "Sleep time (ns)" + constants.DELIMITER + "Counts (%s)" % channel
+    return [channel], header, partial(sleepSteps, channel)
+
+def gridSweep(channel1, channel2, setting):
+    pair = "".join(sorted(channel1 + channel2))
+    header = constants.DELIMITER.join(["Delay time (ns)", "%s (ns)" % setting, "Coincidences"])
+    return [pair], header, partial(gridSteps, channel1, channel2, setting)
+
+class SweepRunner(object):
+    """
+    Runs a sweep with no widgets, for the sweep dialogs and the command line.
+    `make_steps` turns a list of points into the settings of every step.
+    Each point is written to `file_name` as soon as it is measured, and with
+    `resume` the points already in the file are loaded instead of measured
+    again. With `finest`, finer passes are added around the maxima of a one
+    dimensional sweep down to a step of finest.
+
+    `results`, `error` and `finished` can be read from other threads while
+    the sweep runs.
+    """
+    def __init__(self, port, points, channels, n, sampling, make_steps, header, file_name = "",
+                    target = 0, dimensions = 1, finest = None, resume = False):
+        self.points = list(points)
+        self.channels = channels
+        self.make_steps = make_steps
+        self.header = header
+        self.file_name = file_name
+        self.dimensions = dimensions
+        self.finest = finest
+        self.resume = resume
+        self.step = None
+        if (finest != None) and (len(self.points) > 1):
+            self.step = self.points[1] - self.points[0]
+        self.results = SweepResults(len(self.points), len(channels), dimensions)
+        self.sweep = Sweep(port, [], channels, n, sampling, target)
+        self.error = None
+        self.finished = Event() # set when the sweep ends
+
+    def start(self):
+        "Runs the sweep on its own thread"
+        thread = Thread(target = self.run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.sweep.stop()
+
+    def load(self):
+        "Reads the points saved in file_name"
+        with open(self.file_name) as file:
+            header = file.readline().rstrip("\r\n")
+        if header != self.header:
+            raise ValueError("%s does not hold a sweep with the current settings, it can not be resumed." % self.file_name)
+        delimiter = constants.DELIMITER
+        if delimiter.strip() == "": delimiter = None
+        data = np.loadtxt(self.file_name, delimiter = delimiter, skiprows = 1, ndmin = 2)
+        x_data = data[:, :self.dimensions].astype(int)
+        if self.dimensions == 1: x_data = x_data[:, 0]
+        return x_data, data[:, self.dimensions:]
+
+    def run(self):
+        "Measures the sweep on the calling thread, an error ends it and is kept in `error`"
+        file = None
+        try:
+            points = self.points
+            if self.file_name != "":
+                header = self.header
+                if self.resume and os.path.isfile(self.file_name):
+                    x_data, y_data = self.load()
+                    results = SweepResults(len(points) + len(x_data), len(self.channels), self.dimensions)
+                    for (x, values) in zip(x_data, y_data):
+                        results.append(x, values)
+                    self.results = results
+                    measured = set(tuple(np.atleast_1d(x)) for x in x_data)
+                    points = [x for x in points if not tuple(np.atleast_1d(x)) in measured]
+                    header = None
+                file = File(self.file_name, header)
+            self.sweep.addSteps(self.make_steps(points))
+
+            fmt = constants.DELIMITER.join(["%d"] * (len(self.channels) + self.dimensions))
+            step = self.step
+            while True:
+                for (i, values) in self.sweep.iterate():
+                    self.results.append(points[i], values)
+                    if file != None:
+                        file.npwrite(np.array([list(np.atleast_1d(points[i])) + list(values)]), fmt)
+                        file.flush()
+                if self.sweep.isStopped() or (step == None) or (step <= self.finest): break
+                "pass finished, zoom in"
+                previous = step
+                step = max(self.finest, (step // constants.SWEEP_ZOOM // self.finest) * self.finest)
+                new = refineSteps(*self.results.get(), previous, step, min(self.points), max(self.points))
+                points = points + new
+                self.sweep.addSteps(self.make_steps(new))
+        except Exception as e:
+            self.error = e
+        finally:
+            if file != None:
+                file.close()
+            self.finished.set()
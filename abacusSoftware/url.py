@@ -1,5 +1,8 @@
 import abacusSoftware.constants as constants
+import os
 import urllib.request
+from time import time
+from threading import Thread, Event
 
 URL_VERSION = "https://raw.githubusercontent.com/Tausand-dev/AbacusSoftware/master/lastStableVersion.md"
 TARGET_URL = "https://www.tausand.com/downloads/"
@@ -10,13 +13,38 @@ def versionstr(version):
     version = version.split(".")
     return [int(v) for v in version]
 
-def checkUpdate():
+def readCache(path = constants.UPDATE_CACHE_PATH):
+    "Returns the version found online less than UPDATE_CHECK_INTERVAL ago, None if there is none"
     try:
-        with urllib.request.urlopen(URL_VERSION) as response:
-           html = response.read().decode()
-           url_version = versionstr(html)
-    except Exception as e:
-        url_version = [0]
+        if time() - os.path.getmtime(path) < constants.UPDATE_CHECK_INTERVAL:
+            with open(path) as file:
+                return versionstr(file.read().strip())
+    except (OSError, ValueError):
+        pass
+    return None
+
+def writeCache(version, path = constants.UPDATE_CACHE_PATH):
+    try:
+        with open(path, "w") as file:
+            file.write(".".join([str(v) for v in version]))
+    except OSError:
+        pass
+
+def checkUpdate(timeout = constants.UPDATE_TIMEOUT):
+    """
+    Returns the newer version available online, None if there is none. The
+    server is asked at most once every UPDATE_CHECK_INTERVAL, and waited for
+    up to timeout seconds.
+    """
+    url_version = readCache()
+    if url_version == None:
+        try:
+            with urllib.request.urlopen(URL_VERSION, timeout = timeout) as response:
+               html = response.read().decode()
+               url_version = versionstr(html)
+            writeCache(url_version)
+        except Exception as e:
+            url_version = [0]
 
     current_version = versionstr(constants.__version__)
     n = min(len(url_version), len(current_version))
@@ -28,3 +56,23 @@ def checkUpdate():
             return None  #if current_version is greater than url_version, do not update
 
     return None
+
+class UpdateChecker(object):
+    """
+    Runs checkUpdate on a thread, so startup does not wait on the network.
+    `done` is set once `version` holds the result.
+    """
+    def __init__(self):
+        self.version = None
+        self.done = Event()
+
+    def start(self):
+        thread = Thread(target = self.heavyDuty)
+        thread.daemon = True
+        thread.start()
+
+    def heavyDuty(self):
+        try:
+            self.version = checkUpdate()
+        finally:
+            self.done.set()
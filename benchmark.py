@@ -0,0 +1,277 @@
+"""
+Startup benchmark of abacusSoftware.
+
+    python benchmark.py             measures and compares with the baseline
+    python benchmark.py --save      measures and keeps the results as the baseline
+
+Import times are taken with `python -X importtime` on fresh interpreters. The
+cold run compiles every module into an empty bytecode cache, the warm runs
+reuse it. The window stage starts the program on an offscreen display against
+a simulated four channel device: it times the main window being shown, the
+device being connected through the connect dialog and the first sample being
+plotted. The update check is left out, it depends on the network.
+
+A measure slower than its baseline by more than the tolerance is a
+regression, and the exit code is 1. A missing baseline is an error too, it
+has to be recorded on the reference machine with --save.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import time, perf_counter
+from statistics import median
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+MODULES = ["PyQt5.QtWidgets", "numpy", "pyqtgraph", "qdarkstyle", "pyAbacus", "abacusSoftware.main"]
+TOLERANCE = 0.2 # fraction a measure can grow before it is a regression
+MINIMUM_CHANGE = 0.01 # changes below this are noise (s)
+WINDOW_TIMEOUT = 30 # longest wait for the window stage (s)
+SIMULATED_NAME = "Tausand Abacus AB1004"
+SIMULATED_PORT = "SIMULATED"
+
+class SimulatedDevice(object):
+    """
+    A four channel device that answers the pyAbacus calls of the program. Its
+    counters and settings are pyAbacus objects, so settings are validated as
+    on a real device. Singles are Poisson counts, coincidences a fraction of
+    them.
+    """
+    def __init__(self, rate = 1e5):
+        import numpy as np
+        import pyAbacus as abacus
+        self.np = np
+        self.abacus = abacus
+        self.rate = rate
+        self.counters = abacus.CountersValues(4)
+        self.settings = abacus.Settings4Ch()
+        for (setting, value) in [("sampling", 1000), ("coincidence_window", 10)]:
+            self.settings.setSetting(setting, value)
+        for letter in "ABCD":
+            self.settings.setSetting("delay_%s" % letter, 0)
+            self.settings.setSetting("sleep_%s" % letter, 0)
+        self.settings.setSetting("config_custom_c1", "ABC")
+        self.init_time = time()
+
+    def install(self):
+        "Replaces the device calls of pyAbacus, before abacusSoftware is imported"
+        for name in ["findDevices", "open", "close", "getAllCounters", "getCountersID",
+                        "getTimeLeft", "getAllSettings", "getSetting", "setSetting"]:
+            setattr(self.abacus, name, getattr(self, name))
+
+    def getSampling(self):
+        return self.settings.getSetting("sampling") / 1000
+
+    def findDevices(self, print_on = True):
+        return {SIMULATED_NAME: SIMULATED_PORT}, 1
+
+    def open(self, port):
+        pass
+
+    def close(self, port):
+        pass
+
+    def getCountersID(self, port):
+        return int((time() - self.init_time) / self.getSampling())
+
+    def getTimeLeft(self, port):
+        sampling = self.getSampling()
+        return 1000 * (sampling - (time() - self.init_time) % sampling)
+
+    def getAllCounters(self, port):
+        id = self.getCountersID(port)
+        if id != self.counters.getCountersID():
+            singles = self.np.random.poisson(self.rate * self.getSampling(), 4)
+            for (address, letters) in self.counters.numeric_addresses.items():
+                value = min([singles[ord(letter) - ord('A')] for letter in letters])
+                if len(letters) > 1: value = value // 100
+                self.counters.setValueFromArray(address, int(value))
+            self.counters.setValueFromArray(96, int(min(singles[:3]) // 10000)) # custom_c1, ABC
+            self.counters.setCountersID(id)
+        return self.counters, id
+
+    def getAllSettings(self, port):
+        return self.settings
+
+    def getSetting(self, port, setting):
+        return self.settings.getSetting(setting)
+
+    def setSetting(self, port, setting, value):
+        self.settings.setSetting(setting, value)
+        if setting == "sampling":
+            self.init_time = time()
+
+def peakMemory():
+    "Peak resident memory of this process (MB), None where it can not be read"
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": return peak / 2 ** 20
+    return peak / 2 ** 10
+
+def importTimes(cache):
+    "Cumulative import time (s) of every module in MODULES, on a fresh interpreter"
+    env = dict(os.environ, PYTHONPYCACHEPREFIX = cache, PYQTGRAPH_QT_LIB = "PyQt5")
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import abacusSoftware.main"],
+                                env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE,
+                                universal_newlines = True, check = True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"): continue
+        fields = line[len("import time:"):].split("|")
+        name = fields[-1].strip()
+        if name in MODULES and name not in times:
+            times[name] = int(fields[1]) / 1e6
+    return times
+
+def measureImports(repeats):
+    "Cold and warm import times of MODULES, the warm ones are the median of `repeats` runs"
+    with tempfile.TemporaryDirectory() as cache:
+        cold = importTimes(cache)
+        runs = [importTimes(cache) for i in range(repeats)]
+    results = {}
+    for name in cold:
+        results["cold import %s" % name] = cold[name]
+        results["warm import %s" % name] = median([run[name] for run in runs])
+    return results
+
+def windowStage():
+    """
+    Runs on its own interpreter: starts the program against the simulated
+    device and prints the times of the window stage as JSON.
+    """
+    start = perf_counter()
+    device = SimulatedDevice()
+    device.install()
+
+    from PyQt5 import QtCore, QtWidgets
+    import abacusSoftware.common as common
+    import abacusSoftware.resources as resources
+    import abacusSoftware.main as main
+    from abacusSoftware.supportWidgets import ConnectDialog
+    results = {"window import": perf_counter() - start}
+
+    now = perf_counter()
+    common.readConstantsFile()
+    results["readConstantsFile"] = perf_counter() - now
+
+    app = QtWidgets.QApplication(sys.argv)
+    app.setStyle(QtWidgets.QStyleFactory.create('Fusion'))
+    now = perf_counter()
+    resources.load()
+    results["resources"] = perf_counter() - now
+
+    window = main.MainWindow()
+    window.show2()
+    window.resize(800, 600)
+    app.processEvents()
+    results["window shown"] = perf_counter() - start
+    memory = peakMemory()
+    if memory != None: results["memory window shown (MB)"] = memory
+
+    folder = tempfile.TemporaryDirectory()
+    stage = {}
+    def step():
+        modal = QtWidgets.QApplication.activeModalWidget()
+        if isinstance(modal, ConnectDialog):
+            modal.accept()
+        elif window.port_name != None and not window.streaming:
+            stage["connected"] = perf_counter()
+            window.sampling_widget.setValue(min(device.abacus.constants.SAMPLING_VALUES))
+            if window.results_files == None:
+                window.save_as_lineEdit.setText(common.unicodePath(os.path.join(folder.name, "benchmark.dat")))
+                window.setSaveAs()
+            window.startAcquisition()
+        elif window.plotted_rows > 0:
+            stage["plotted"] = perf_counter()
+            app.quit()
+
+    timer = QtCore.QTimer()
+    timer.setInterval(1)
+    timer.timeout.connect(step)
+    timer.start()
+    QtCore.QTimer.singleShot(1000 * WINDOW_TIMEOUT, app.quit)
+    app.exec_()
+    timer.stop()
+
+    if window.streaming: window.stopClocks()
+    if window.data_ring != None: window.data_ring.close()
+    if window.results_files != None: window.results_files.close()
+    folder.cleanup()
+
+    if "plotted" not in stage:
+        raise RuntimeError("No sample was plotted in %d s." % WINDOW_TIMEOUT)
+    results["connected"] = stage["connected"] - start
+    results["first sample"] = stage["plotted"] - start
+    results["sample after start"] = stage["plotted"] - stage["connected"]
+    memory = peakMemory()
+    if memory != None: results["memory first sample (MB)"] = memory
+    print(json.dumps(results))
+
+def measureWindow():
+    env = dict(os.environ, QT_QPA_PLATFORM = "offscreen", PYQTGRAPH_QT_LIB = "PyQt5")
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--window"], env = env,
+                                stdout = subprocess.PIPE, universal_newlines = True, check = True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def compare(results, baseline, tolerance):
+    "Prints every measure next to its baseline, returns the names of the regressions"
+    regressions = []
+    print("%-40s %12s %12s %9s" % ("", "now", "baseline", "change"))
+    for (name, value) in results.items():
+        unit = "MB" if "MB" in name else "ms"
+        scale = 1 if unit == "MB" else 1000
+        base = baseline.get(name)
+        if base == None:
+            print("%-40s %9.1f %s %12s %9s" % (name, value * scale, unit, "-", "-"))
+            continue
+        change = (value - base) / base if base else 0
+        flag = ""
+        if (change > tolerance) and (unit == "MB" or value - base > MINIMUM_CHANGE):
+            regressions.append(name)
+            flag = " <-"
+        print("%-40s %9.1f %s %9.1f %s %+8.1f%%%s" % (name, value * scale, unit, base * scale, unit, 100 * change, flag))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Measures the import and startup times of abacusSoftware.")
+    parser.add_argument("--save", action = "store_true", help = "keep the results as the baseline")
+    parser.add_argument("--baseline", default = BASELINE_PATH, help = "baseline file (default: %(default)s)")
+    parser.add_argument("--repeats", type = int, default = 5, help = "warm import runs (default: %(default)s)")
+    parser.add_argument("--tolerance", type = float, default = TOLERANCE,
+                        help = "fraction a measure can grow before it is a regression (default: %(default)s)")
+    parser.add_argument("--window", action = "store_true", help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.window:
+        windowStage()
+        return 0
+    if not (args.save or os.path.exists(args.baseline)):
+        print("No baseline on %s, record one with `python benchmark.py --save` (make benchmark_baseline)." % args.baseline)
+        return 1
+
+    results = measureImports(args.repeats)
+    results.update(measureWindow())
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent = 4, sort_keys = True)
+        print("Baseline saved on %s" % args.baseline)
+        return 0
+    if len(regressions):
+        print("Slower than the baseline: %s" % ", ".join(regressions))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
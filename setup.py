@@ -20,11 +20,12 @@ setup(
     keywords="example documentation tutorial",
     url="https://github.com/Tausand-dev/AbacusSoftware",
     packages=['abacusSoftware'],
+    package_data={'abacusSoftware': ['images.rcc']},
     install_requires=['pyAbacus>=1.1', 'pyserial', 'numpy', 'pyqtgraph', 'PyQt5', 'qdarkstyle'],
     long_description="",
     entry_points={
         'console_scripts': [
-            'abacusSoftware = abacusSoftware.main:run',
+            'abacusSoftware = abacusSoftware.cli:main',
         ],
     },
     classifiers=[
@@ -0,0 +1,58 @@
+import numpy as np
+
+from abacusSoftware.files import RingBuffer
+
+def makeRows(ring, first, last):
+    "Rows with IDs from first to last, both included"
+    rows = np.zeros(last - first + 1, dtype = ring.dtype)
+    rows["ID"] = np.arange(first, last + 1)
+    rows["Time (s)"] = rows["ID"] / 10
+    return rows
+
+def makeRing(size):
+    ring = RingBuffer(size, ["A", "B", "AB"])
+    ring.save = lambda: None # no file, keep the tests quiet
+    return ring
+
+def testGrowAfterWrap():
+    ring = makeRing(5)
+    ring.extend(makeRows(ring, 1, 7))
+    ring.resize(10)
+    assert len(ring) == 5
+    assert list(ring["ID"]) == [3, 4, 5, 6, 7]
+    assert ring.lastRow()["ID"] == 7
+    ring.extend(makeRows(ring, 8, 14))
+    assert len(ring) == 10
+    assert list(ring["ID"]) == list(range(5, 15))
+
+def testShrinkAfterWrap():
+    ring = makeRing(5)
+    ring.extend(makeRows(ring, 1, 7))
+    ring.resize(3)
+    assert len(ring) == 3
+    assert list(ring["ID"]) == [5, 6, 7]
+    ring.extend(makeRows(ring, 8, 9))
+    assert list(ring["ID"]) == [7, 8, 9]
+
+def testGrowBeforeWrap():
+    ring = makeRing(5)
+    ring.extend(makeRows(ring, 1, 3))
+    ring.resize(10)
+    assert list(ring["ID"]) == [1, 2, 3]
+    ring.clear()
+    assert len(ring) == 0
+    assert ring.lastRow() is None
+
+def testHistoryAttachedLater():
+    "rows saved before the history starts are not in it, and rows in the buffer are never repeated"
+    ring = RingBuffer(5, ["A", "B", "AB"])
+    ring.extend(makeRows(ring, 1, 7))
+    ring.setHistory(True)
+    ring.extend(makeRows(ring, 8, 20))
+    ring.save()
+    ring.join()
+    assert list(ring["ID"]) == [16, 17, 18, 19, 20]
+    assert list(ring.getHistory()["ID"]) == list(range(6, 16)) # the first save after it holds 6 to 10
+    ring.setHistory(False)
+    assert ring.getHistory() is None
+    ring.close()
@@ -0,0 +1,45 @@
+import numpy as np
+
+from abacusSoftware.fitting import fitPeaks, FWHM_SIGMA
+
+DELAYS = np.arange(-100, 101, 5.)
+
+def topHat(x, start, stop, height = 1000., background = 10.):
+    return np.where((x >= start) & (x <= stop), height, background)
+
+def testGaussian():
+    y = 10 + 1000 * np.exp(-(DELAYS - 7) ** 2 / (2 * 12 ** 2))
+    center, width, height, background = fitPeaks(DELAYS, y)
+    assert abs(center[0] - 7) < 0.1
+    assert abs(width[0] - FWHM_SIGMA * 12) < 0.5
+    assert abs(background[0] - 10) < 1
+
+def testTopHat():
+    for (start, stop) in [(-30, -10), (10, 40)]:
+        center, width, height, background = fitPeaks(DELAYS, topHat(DELAYS, start, stop))
+        assert center[0] == (start + stop) / 2
+        assert stop - start <= width[0] <= stop - start + 5
+
+def testNoisyTopHat():
+    random = np.random.RandomState(1)
+    for i in range(50):
+        y = random.poisson(topHat(DELAYS, -5, 25)).astype(float)
+        center, width, height, background = fitPeaks(DELAYS, y)
+        assert abs(center[0] - 10) < 1
+        assert 30 <= width[0] <= 40
+
+def testAdaptiveBackground():
+    "a fine pass on the peak does not move the background"
+    x = np.unique(np.concatenate((np.arange(-100, 101, 20.), np.arange(-5, 26, 1.))))
+    y = 10 + 1000 * np.exp(-(x - 10) ** 2 / (2 * 8 ** 2))
+    center, width, height, background = fitPeaks(x, y)
+    assert abs(background[0] - 10) < 1
+    assert abs(center[0] - 10) < 0.1
+    assert abs(width[0] - FWHM_SIGMA * 8) < 0.5
+
+def testColumns():
+    y = np.column_stack((topHat(DELAYS, 10, 40), 10 + 1000 * np.exp(-DELAYS ** 2 / 200), np.zeros_like(DELAYS)))
+    center, width, height, background = fitPeaks(DELAYS, y)
+    assert center[0] == 25
+    assert abs(center[1]) < 0.1
+    assert np.isnan(center[2])